@@ -0,0 +1,242 @@
+"""Benchmark and accuracy checks for the image stitching pipeline.
+
+Run from the Lab 3 directory:
+
+    python benchmark.py [--scale 0.5] [--skip-end-to-end] [--skip-memory]
+
+Every stage is reported with its wall time and peak traced memory. The time
+comes from an untraced run; the memory from a second run under tracemalloc,
+whose overhead would otherwise skew the timings of Python-heavy stages. Stages
+that estimate a homography also report their inlier counts and, where the
+true homography is known, the mean reprojection error in pixels.
+"""
+import argparse
+import os
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from skimage.color import rgb2gray
+from skimage.feature import corner_peaks
+from skimage.filters import gaussian
+from skimage.io import imread
+from skimage.transform import rescale
+
+from image_stitching import (harris_corners, describe_keypoints, simple_descriptor,
+                             sift_descriptor, match_descriptors, compute_homography,
+                             ransac, stitch_multiple_images, transform_homography)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# Set to False by --skip-memory to time every stage only once
+MEASURE_MEMORY = True
+
+
+def load_gray(name, scale=1.0):
+    img = imread(os.path.join(DATA_DIR, name))
+    if img.ndim == 3:
+        img = rgb2gray(img[..., :3])
+    else:
+        img = img / 255.
+    if scale < 1.0:
+        # Anti-alias before downsampling, as rescale(anti_aliasing=True) does
+        # on newer scikit-image
+        img = gaussian(img, sigma=(1 / scale - 1) / 2, mode='reflect')
+    if scale != 1.0:
+        img = rescale(img, scale, mode='reflect')
+    return img
+
+
+def measure(fn, *args, **kwargs):
+    """
+    Time fn on an untraced run, then run it again under tracemalloc for its
+    peak memory unless MEASURE_MEMORY is False.
+
+    Returns:
+        result: return value of the first run of fn
+        seconds: wall time of the untraced run
+        peak_mb: peak memory traced during the second run in MiB, or nan
+    """
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    if not MEASURE_MEMORY:
+        return result, seconds, float('nan')
+
+    tracemalloc.start()
+    try:
+        fn(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak / 2 ** 20
+
+
+def reprojection_error(h_est, h_true, shape, n=50):
+    """
+    Mean distance between points of an image mapped by the estimated and the
+    true homography, over an n x n grid covering the image.
+    """
+    h, w = shape[:2]
+    xs, ys = np.meshgrid(np.linspace(0, w - 1, n), np.linspace(0, h - 1, n))
+    pts = np.stack([xs.ravel(), ys.ravel()], axis=1)
+    diff = transform_homography(pts, h_est) - transform_homography(pts, h_true)
+    return float(np.mean(np.linalg.norm(diff, axis=1)))
+
+
+def synthetic_pair(img, seed=0):
+    """
+    Make a second view of img with a known homography.
+
+    Returns:
+        img2: img warped by h_true
+        h_true: homography mapping (x, y) points of img to img2
+    """
+    rng = np.random.RandomState(seed)
+    h, w = img.shape[:2]
+    src = np.array([[0, 0], [w, 0], [0, h], [w, h]], dtype=np.float64)
+    dst = src + rng.uniform(-0.08, 0.08, size=(4, 2)) * [w, h]
+    h_true = compute_homography(src, dst)
+    # Reflect at the border so that the edges of the warped image do not
+    # produce corner responses stronger than the scene itself
+    img2 = cv2.warpPerspective(img.astype(np.float32), h_true, (w, h),
+                               borderMode=cv2.BORDER_REFLECT).astype(np.float64)
+    return img2, h_true
+
+
+class Report(object):
+    """Collects benchmark rows and prints them as a table."""
+
+    columns = ('case', 'stage', 'time_s', 'peak_mb', 'count', 'inliers', 'reproj_px')
+
+    def __init__(self):
+        self.rows = []
+
+    def add(self, case, stage, seconds, peak_mb, count='', inliers='', reproj=''):
+        if isinstance(reproj, float):
+            reproj = '%.3f' % reproj
+        self.rows.append((case, stage, '%.3f' % seconds, '%.1f' % peak_mb,
+                          str(count), str(inliers), reproj))
+        print('  '.join(str(v) for v in self.rows[-1]), flush=True)
+
+    def show(self):
+        widths = [max(len(str(r[i])) for r in self.rows + [self.columns])
+                  for i in range(len(self.columns))]
+        for row in [self.columns] + self.rows:
+            print('  '.join(str(v).ljust(wd) for v, wd in zip(row, widths)))
+
+
+def bench_pair(report, case, img1, img2, h_true=None, patch_size=5):
+    """Benchmark every stage of pairwise registration on two images."""
+    keypoints = []
+    for i, img in enumerate((img1, img2)):
+        response, t, mem = measure(harris_corners, img, window_size=3)
+        report.add(case, 'harris_corners[%d]' % i, t, mem)
+        kp, t, mem = measure(corner_peaks, response, threshold_rel=0.05, exclude_border=8)
+        report.add(case, 'corner_peaks[%d]' % i, t, mem, count=len(kp))
+        keypoints.append(kp)
+
+    for name, desc_func, size in (('simple', simple_descriptor, patch_size),
+                                  ('sift', sift_descriptor, 16)):
+        descs = []
+        for i, img in enumerate((img1, img2)):
+            desc, t, mem = measure(describe_keypoints, img, keypoints[i],
+                                   desc_func=desc_func, patch_size=size)
+            report.add(case, 'describe_%s[%d]' % (name, i), t, mem, count=len(desc))
+            descs.append(desc)
+
+        matches, t, mem = measure(match_descriptors, descs[0], descs[1], 0.7)
+        report.add(case, 'match_%s' % name, t, mem, count=len(matches))
+
+        (H, inliers), t, mem = measure(ransac, keypoints[0], keypoints[1], matches, seed=0)
+        reproj = reprojection_error(H, h_true, img1.shape) if h_true is not None else ''
+        report.add(case, 'ransac_%s' % name, t, mem, count=len(matches),
+                   inliers=len(inliers), reproj=reproj)
+
+        if len(inliers) >= 4:
+            src = keypoints[0][inliers[:, 0]][:, ::-1].astype(np.float64)
+            dst = keypoints[1][inliers[:, 1]][:, ::-1].astype(np.float64)
+            H, t, mem = measure(compute_homography, src, dst)
+            reproj = reprojection_error(H, h_true, img1.shape) if h_true is not None else ''
+            report.add(case, 'compute_homography_%s' % name, t, mem,
+                       count=len(inliers), reproj=reproj)
+
+
+def bench_harris_reference(report, name, solution):
+    """Compare the Harris response of an image with its reference rendering."""
+    img = load_gray(name)
+    response, t, mem = measure(harris_corners, img, window_size=3)
+    reference = load_gray(solution)
+    if reference.shape != response.shape:
+        reference = cv2.resize(reference.astype(np.float32), response.shape[::-1])
+    corr = np.corrcoef(response.ravel(), reference.ravel())[0, 1]
+    report.add(name, 'harris_vs_%s (corr=%.3f)' % (solution, corr), t, mem)
+
+
+def bench_end_to_end(report, case, imgs, desc_func, patch_size):
+    panorama, t, mem = measure(stitch_multiple_images, imgs,
+                               desc_func=desc_func, patch_size=patch_size, seed=0)
+    report.add(case, 'stitch_%s %dx%d' % (desc_func.__name__, panorama.shape[1],
+                                         panorama.shape[0]), t, mem, count=len(imgs))
+    return panorama
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=float, default=0.5,
+                        help='scale applied to the photographs before benchmarking')
+    parser.add_argument('--skip-end-to-end', action='store_true',
+                        help='only benchmark the individual stages')
+    parser.add_argument('--output', default=None,
+                        help='directory to save the stitched panoramas to')
+    parser.add_argument('--skip-memory', action='store_true',
+                        help='do not rerun every stage under tracemalloc')
+    args = parser.parse_args()
+
+    global MEASURE_MEMORY
+    MEASURE_MEMORY = not args.skip_memory
+
+    report = Report()
+
+    for name, solution in (('checker.jpg', 'solution_harris_checker.jpg'),
+                           ('letterbox.jpg', 'solution_harris_letterbox.jpg')):
+        bench_harris_reference(report, name, solution)
+
+    img_a = load_gray('marinabay_a.jpg', args.scale)
+    img_b = load_gray('marinabay_b.jpg', args.scale)
+    bench_pair(report, 'marinabay_a/b', img_a, img_b)
+
+    for name in ('marinabay_a.jpg', 'checker.jpg', 'letterbox.jpg'):
+        img = load_gray(name, args.scale if name.startswith('marina') else 1.0)
+        img2, h_true = synthetic_pair(img)
+        bench_pair(report, 'synthetic:' + name, img, img2, h_true)
+
+    if not args.skip_end_to_end:
+        panoramas = {}
+        panoramas['marinabay_ab_simple'] = bench_end_to_end(
+            report, 'marinabay_a/b', [img_a, img_b], simple_descriptor, 5)
+        panoramas['marinabay_ab_sift'] = bench_end_to_end(
+            report, 'marinabay_a/b', [img_a, img_b], sift_descriptor, 16)
+
+        # Overlapping crops of marina_bay; neighbours differ by a known shift
+        bay = load_gray('marina_bay.jpg', args.scale)
+        w = bay.shape[1]
+        crops = [bay[:, k * w // 6:k * w // 6 + w // 3] for k in range(5)]
+        panorama = bench_end_to_end(report, 'marina_bay x5', crops, simple_descriptor, 5)
+        panoramas['marina_bay_simple'] = panorama
+        report.add('marina_bay x5', 'panorama/original width %.3f'
+                   % (panorama.shape[1] / float(w)), 0, 0)
+
+        if args.output:
+            os.makedirs(args.output, exist_ok=True)
+            for name, pano in panoramas.items():
+                out = np.clip(pano * 255, 0, 255).astype(np.uint8)
+                cv2.imwrite(os.path.join(args.output, name + '.png'), out)
+
+    print()
+    report.show()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+import hashlib
+import os
+import uuid
+
+import numpy as np
+
+
+class FeatureCache(object):
+    """
+    On-disk cache of keypoints and descriptors.
+
+    Entries are keyed by a hash of the image content together with the
+    detector and descriptor parameters, and stored as a pair of .npy files
+    that are loaded memory-mapped. When the cache grows past `max_bytes`,
+    the least recently used entries are removed.
+
+    Args:
+        cache_dir: directory holding the cached entries
+        max_bytes: maximum total size of the cached files in bytes, or None
+            for no limit
+    """
+
+    def __init__(self, cache_dir, max_bytes=1 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, img, desc_func, **params):
+        """
+        Compute the cache key of an image and its feature parameters.
+
+        Args:
+            img: image the features are computed from
+            desc_func: descriptor function used to describe the keypoints
+            params: detector and descriptor parameters, e.g. window_size, k,
+                threshold_rel and patch_size
+
+        Returns:
+            key: hex digest identifying the entry
+        """
+        img = np.ascontiguousarray(img)
+        h = hashlib.sha1()
+        h.update(str((img.shape, img.dtype.str)).encode())
+        h.update(img.data)
+        h.update(('%s.%s' % (desc_func.__module__, desc_func.__name__)).encode())
+        h.update(repr(sorted(params.items())).encode())
+        return h.hexdigest()
+
+    def _paths(self, key):
+        return (os.path.join(self.cache_dir, key + '_kp.npy'),
+                os.path.join(self.cache_dir, key + '_desc.npy'))
+
+    def get(self, key):
+        """
+        Look up an entry.
+
+        Args:
+            key: cache key from `key`
+
+        Returns:
+            (keypoints, descriptors) as read-only memory-mapped arrays, or None
+            if the entry is not cached
+        """
+        kp_path, desc_path = self._paths(key)
+        try:
+            keypoints = np.load(kp_path, mmap_mode='r')
+            descriptors = np.load(desc_path, mmap_mode='r')
+        except (IOError, OSError, ValueError):
+            return None
+        # Mark the entry as recently used for eviction
+        for path in (kp_path, desc_path):
+            os.utime(path, None)
+        return keypoints, descriptors
+
+    def put(self, key, keypoints, descriptors):
+        """
+        Store an entry and evict old entries if the cache is over budget.
+
+        Args:
+            key: cache key from `key`
+            keypoints: array of shape (K, 2)
+            descriptors: array of shape (K, P)
+        """
+        for path, arr in zip(self._paths(key), (keypoints, descriptors)):
+            # Write to a temporary name first so readers never see partial files
+            tmp_path = '%s.%s.tmp.npy' % (path[:-len('.npy')], uuid.uuid4().hex)
+            np.save(tmp_path, np.asarray(arr))
+            os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits max_bytes."""
+        if self.max_bytes is None:
+            return
+        entries = {}
+        for name in os.listdir(self.cache_dir):
+            if not (name.endswith('_kp.npy') or name.endswith('_desc.npy')):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            key = name.rsplit('_', 1)[0]
+            size, mtime = entries.get(key, (0, 0))
+            entries[key] = (size + stat.st_size, max(mtime, stat.st_mtime))
+
+        total = sum(size for size, _ in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k][1]):
+            if total <= self.max_bytes:
+                break
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= entries[key][0]
@@ -0,0 +1,134 @@
+import numpy as np
+
+
+class HomogeneousBuffer(object):
+    """
+    Reusable storage for homogeneous coordinates.
+
+    The last column is filled with ones once when the buffer grows, so padding
+    a point set only copies its coordinates.
+
+    Args:
+        capacity: initial number of rows
+        dim: dimension of the points before padding
+        dtype: dtype of the buffer
+    """
+
+    def __init__(self, capacity=0, dim=2, dtype=np.float64):
+        self.dim = dim
+        self._buf = np.ones((capacity, dim + 1), dtype=dtype)
+
+    def pad(self, pts):
+        """
+        Args:
+            pts: points of shape (N, dim)
+
+        Returns:
+            view of shape (N, dim + 1) holding (pts, 1); valid until the next call
+        """
+        n = len(pts)
+        if n > len(self._buf):
+            self._buf = np.ones((max(n, 2 * len(self._buf)), self.dim + 1),
+                                dtype=self._buf.dtype)
+        out = self._buf[:n]
+        out[:, :self.dim] = pts
+        return out
+
+
+def to_homogeneous(pts, out=None):
+    """
+    Args:
+        pts: points of shape (..., N, d)
+        out: optional array of shape (..., N, d + 1) to write into
+
+    Returns:
+        homogeneous points of shape (..., N, d + 1)
+    """
+    pts = np.asarray(pts)
+    if out is None:
+        out = np.empty(pts.shape[:-1] + (pts.shape[-1] + 1,),
+                       dtype=np.result_type(pts.dtype, np.float32))
+    out[..., :-1] = pts
+    out[..., -1] = 1
+    return out
+
+
+def transform_points(pts, h_matrices, normalize=True, buffer=None):
+    """
+    Apply one or many homographies to a set of 2D points.
+
+    Args:
+        pts: (x, y) points of shape (N, 2), or points already padded with
+            to_homogeneous of shape (N, 3), which are used as they are
+        h_matrices: homography of shape (3, 3), or a batch of shape (K, 3, 3)
+        normalize: divide by the homogeneous coordinate if True, otherwise
+            return the homogeneous result
+        buffer: optional HomogeneousBuffer used to pad pts
+
+    Returns:
+        transformed points of shape (N, 2), or (K, N, 2) for a batch;
+        (N, 3) or (K, N, 3) if normalize is False
+    """
+    if np.shape(pts)[-1] == 3:
+        h_pts = pts
+    elif buffer is not None:
+        h_pts = buffer.pad(pts)
+    else:
+        h_pts = to_homogeneous(pts)
+    h_matrices = np.asarray(h_matrices)
+    # (..., 3, 3) x (N, 3)^T -> (..., N, 3)
+    transformed = np.matmul(h_pts, np.swapaxes(h_matrices, -1, -2))
+    if not normalize:
+        return transformed
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return transformed[..., :2] / transformed[..., 2:]
+
+
+def normalization_transforms(pts):
+    """
+    Similarity transforms that normalize point sets for the DLT.
+
+    Each point set is translated to zero mean and scaled by sqrt(2) over the
+    standard deviation of its homogeneous coordinates.
+
+    Args:
+        pts: point set of shape (N, 2), or a batch of shape (K, N, 2)
+
+    Returns:
+        T: transform of shape (3, 3), or (K, 3, 3) for a batch
+    """
+    pts = np.asarray(pts, dtype=np.float64)
+    single = pts.ndim == 2
+    if single:
+        pts = pts[None]
+    K, N, _ = pts.shape
+    m = pts.mean(axis=1)
+    with np.errstate(divide='ignore'):
+        s = np.sqrt(2) / to_homogeneous(pts).reshape(K, -1).std(axis=1)
+
+    T = np.zeros((K, 3, 3))
+    T[:, 0, 0] = s
+    T[:, 1, 1] = s
+    T[:, 0, 2] = -s * m[:, 0]
+    T[:, 1, 2] = -s * m[:, 1]
+    T[:, 2, 2] = 1
+    return T[0] if single else T
+
+
+def invert_normalization(T):
+    """
+    Inverse of transforms from normalization_transforms, without a general
+    matrix inverse.
+
+    Args:
+        T: transform of shape (..., 3, 3)
+
+    Returns:
+        inverse of shape (..., 3, 3)
+    """
+    T_inv = np.zeros_like(T)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        T_inv[..., 0, 0] = T_inv[..., 1, 1] = 1 / T[..., 0, 0]
+        T_inv[..., :2, 2] = -T[..., :2, 2] / T[..., 0, 0, None]
+    T_inv[..., 2, 2] = 1
+    return T_inv
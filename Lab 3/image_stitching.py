@@ -1,11 +1,16 @@
 import numpy as np
 from skimage import filters
 from skimage.feature import corner_peaks
+from skimage.transform import pyramid_reduce
+from scipy.spatial import cKDTree
 from scipy.spatial.distance import cdist
 from scipy.ndimage.filters import convolve
 import math
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 from utils import pad, get_output_space, unpad
+from geometry import (to_homogeneous, transform_points, normalization_transforms,
+                      invert_normalization)
 
 import cv2
 _COLOR_RED = (255, 0, 0)
@@ -17,22 +22,121 @@ _COLOR_GREEN = (0, 255, 0)
 _COLOR_BLUE = (0, 0, 255)
 
 def trim(frame):
-    if not np.sum(frame[0]):
-        return trim(frame[1:])
-    if not np.sum(frame[-1]):
-        return trim(frame[:-2])
-    if not np.sum(frame[:,0]):
-        return trim(frame[:,1:])
-    if not np.sum(frame[:,-1]):
-        return trim(frame[:,:-2])
-    return frame
+    """
+    Crop away the all-zero rows and columns around the content of an image.
+
+    Args:
+        frame: image of shape (H, W) or (H, W, C)
+
+    Returns:
+        cropped view of frame; an empty frame if it has no content
+    """
+    content = frame != 0
+    if content.ndim == 3:
+        content = content.any(axis=2)
+    rows = np.nonzero(content.any(axis=1))[0]
+    cols = np.nonzero(content.any(axis=0))[0]
+    if len(rows) == 0:
+        return frame[:0, :0]
+    return frame[rows[0]:rows[-1]+1, cols[0]:cols[-1]+1]
+
+
+def warp_footprint(shape, h_matrix):
+    """
+    Bounding box of an image after a perspective transformation.
+
+    Args:
+        shape: (H, W) of the image
+        h_matrix: homography mapping (x, y) points of the image
+
+    Returns:
+        bbox: integer (x0, y0, x1, y1) such that the warped image lies in
+            columns [x0, x1) and rows [y0, y1)
+    """
+    h, w = shape[:2]
+    corners = np.array([[0, 0], [w, 0], [0, h], [w, h]], dtype=np.float64)
+    warped = transform_homography(corners, h_matrix)
+    x0, y0 = np.floor(warped.min(axis=0)).astype(int)
+    x1, y1 = np.ceil(warped.max(axis=0)).astype(int)
+    return x0, y0, x1, y1
+
+
+def warp_perspective_tiled(img, h_matrix, bbox, tile_size=1024):
+    """
+    Render the part of a warped image that falls inside a bounding box.
+
+    The box is rendered tile by tile. Every tile is inverse-mapped into the
+    source image, and only the source region it reads from is passed to
+    cv2.warpPerspective; tiles that do not see the source are left empty.
+
+    Args:
+        img: image of shape (H, W) or (H, W, C) with C <= 4
+        h_matrix: homography mapping (x, y) points of img to output points
+        bbox: (x0, y0, x1, y1) output region to render
+        tile_size: side length of the rendered tiles
+
+    Returns:
+        warped: float32 array of shape (y1 - y0, x1 - x0) + img.shape[2:]
+    """
+    x0, y0, x1, y1 = bbox
+    img = img.astype(np.float32, copy=False)
+    h, w = img.shape[:2]
+    warped = np.zeros((max(y1 - y0, 0), max(x1 - x0, 0)) + img.shape[2:], dtype=np.float32)
+    h_inv = np.linalg.inv(h_matrix)
+
+    for ty in range(y0, y1, tile_size):
+        for tx in range(x0, x1, tile_size):
+            th, tw = min(tile_size, y1 - ty), min(tile_size, x1 - tx)
+            corners = np.array([[tx, ty], [tx + tw, ty], [tx, ty + th], [tx + tw, ty + th]],
+                               dtype=np.float64)
+            src = pad(corners).dot(h_inv.T)
+            if np.all(src[:, 2] > 0):
+                src = src[:, :2] / src[:, 2:]
+                # One pixel of margin for the bilinear interpolation
+                sx0, sy0 = np.maximum(np.floor(src.min(axis=0)).astype(int) - 1, 0)
+                sx1, sy1 = np.minimum(np.ceil(src.max(axis=0)).astype(int) + 2, [w, h])
+                if sx0 >= sx1 or sy0 >= sy1:
+                    continue
+            else:
+                # The tile crosses the horizon of the transform; read everything
+                sx0, sy0, sx1, sy1 = 0, 0, w, h
+
+            M = np.array([[1, 0, -tx], [0, 1, -ty], [0, 0, 1]], dtype=np.float64)
+            M = M.dot(h_matrix).dot(np.array([[1, 0, sx0], [0, 1, sy0], [0, 0, 1]],
+                                             dtype=np.float64))
+            warped[ty - y0:ty - y0 + th, tx - x0:tx - x0 + tw] = cv2.warpPerspective(
+                img[sy0:sy1, sx0:sx1], M, (tw, th))
+    return warped
 
 
 def warp_image(src, dst, h_matrix):
-    dst = dst.copy()
-    dst = cv2.warpPerspective(dst, np.linalg.inv(h_matrix), (src.shape[1] + dst.shape[1], src.shape[0]))
-    dst[0:src.shape[0], 0:src.shape[1]] = src
-    return dst
+    """
+    Warp dst into the frame of src and paste src over it.
+
+    Only the footprint of the warped dst is rendered, and the canvas is just
+    large enough to hold src and the part of dst right of and below the
+    origin of src.
+
+    Args:
+        src: reference image
+        dst: image to warp; h_matrix maps (x, y) points of src to dst
+        h_matrix: homography of shape (3, 3)
+
+    Returns:
+        canvas: image holding src and the warped dst
+    """
+    M = np.linalg.inv(h_matrix)
+    x0, y0, x1, y1 = warp_footprint(dst.shape, M)
+    out_H = max(src.shape[0], y1)
+    out_W = max(src.shape[1], x1)
+    x0, y0 = max(x0, 0), max(y0, 0)
+
+    canvas = np.zeros((out_H, out_W) + dst.shape[2:], dtype=dst.dtype)
+    if x0 < x1 and y0 < y1:
+        warped = warp_perspective_tiled(dst, M, (x0, y0, x1, y1))
+        canvas[y0:y1, x0:x1] = warped.astype(dst.dtype, copy=False)
+    canvas[0:src.shape[0], 0:src.shape[1]] = src
+    return canvas
 
 def draw_matches(im1, im2, im1_pts, im2_pts, inlier_mask=None):
     """Generates a image line correspondences
@@ -82,27 +186,96 @@ def draw_matches(im1, im2, im1_pts, im2_pts, inlier_mask=None):
 
     return canvas
 
-def transform_homography(src, h_matrix, getNormalized = True):
+def transform_homography(src, h_matrix, getNormalized = True, buffer=None):
     """Performs the perspective transformation of coordinates
 
     Args:
         src (np.ndarray): Coordinates of points to transform (N,2)
-        h_matrix (np.ndarray): Homography matrix (3,3)
+        h_matrix (np.ndarray): Homography matrix (3,3), or a batch of
+                               homographies (K,3,3)
+        getNormalized (bool): Divide by the homogeneous coordinate
+        buffer (HomogeneousBuffer): Optional reusable padding buffer
 
     Returns:
-        transformed (np.ndarray): Transformed coordinates (N,2)
+        transformed (np.ndarray): Transformed coordinates (N,2), or (K,N,2)
+                                  for a batch. Float32 input stays float32,
+                                  anything else is float64.
 
     """
-    transformed = None
+    transformed = transform_points(src, h_matrix, normalize=getNormalized, buffer=buffer)
+    dtype = np.result_type(np.asarray(src).dtype, np.float32)
+    return transformed.astype(dtype, copy=False)
+
+def _dlt_matrix(src, dst):
+    """Assembles the DLT system A h = 0 for batches of correspondences.
+
+    Args:
+        src (np.ndarray): Source points of shape (K,N,2)
+        dst (np.ndarray): Destination points of shape (K,N,2)
+
+    Returns:
+        A (np.ndarray): Matrices of shape (K,2N,9)
+    """
+    K, N, _ = src.shape
+    x_src, y_src = src[..., 0], src[..., 1]
+    x_dst, y_dst = dst[..., 0], dst[..., 1]
+
+    A = np.zeros((K, N, 2, 9))
+    A[:, :, 0, 0] = -x_src
+    A[:, :, 0, 1] = -y_src
+    A[:, :, 0, 2] = -1
+    A[:, :, 0, 6] = x_src * x_dst
+    A[:, :, 0, 7] = y_src * x_dst
+    A[:, :, 0, 8] = x_dst
+    A[:, :, 1, 3] = -x_src
+    A[:, :, 1, 4] = -y_src
+    A[:, :, 1, 5] = -1
+    A[:, :, 1, 6] = x_src * y_dst
+    A[:, :, 1, 7] = y_src * y_dst
+    A[:, :, 1, 8] = y_dst
+    return A.reshape(K, 2 * N, 9)
+
+
+def _normalized_dlt(src, dst, solve, normalize=True):
+    """Runs the normalized DLT on batches of correspondences.
+
+    Args:
+        src (np.ndarray): Source points of shape (K,N,2)
+        dst (np.ndarray): Destination points of shape (K,N,2)
+        solve (callable): Maps A of shape (K,2N,9) to the null vectors of
+                          shape (K,9)
+        normalize (bool): Normalize each problem's points; pass False for
+                          points that are already normalized
+
+    Returns:
+        h_matrices (np.ndarray): Homographies of shape (K,3,3)
+    """
+    src = np.asarray(src, dtype=np.float64)
+    dst = np.asarray(dst, dtype=np.float64)
+
+    if not normalize:
+        with np.errstate(invalid='ignore'):
+            H = solve(_dlt_matrix(src, dst)).reshape(-1, 3, 3)
+            return H / H[:, 2:, 2:]
+
+    # Finding the transformation T that normalises the points
+    T_src = normalization_transforms(src)
+    T_dst = normalization_transforms(dst)
+    norm_src = src * T_src[:, None, 0, 0, None] + T_src[:, None, :2, 2]
+    norm_dst = dst * T_dst[:, None, 0, 0, None] + T_dst[:, None, :2, 2]
+
+    # Standard DLT
+    with np.errstate(invalid='ignore'):
+        H = solve(_dlt_matrix(norm_src, norm_dst)).reshape(-1, 3, 3)
+
+    # Denormalising data
+    with np.errstate(divide='ignore', invalid='ignore'):
+        h_matrices = invert_normalization(T_dst) @ H @ T_src
+
+        # Making H affine
+        h_matrices = h_matrices / h_matrices[:, 2:, 2:]
+    return h_matrices
 
-    input_pts = np.insert(src, 2, values=1, axis=1)
-    transformed = np.zeros_like(input_pts)
-    transformed = h_matrix.dot(input_pts.transpose())
-    if getNormalized:
-        transformed = transformed[:-1]/transformed[-1]
-    transformed = transformed.transpose().astype(np.float32)
-    
-    return transformed
 
 def compute_homography(src, dst):
     """Calculates the perspective transform from at least 4 points of
@@ -124,53 +297,48 @@ def compute_homography(src, dst):
     h_matrix = np.eye(3, dtype=np.float64)
 
     ### YOUR CODE HERE
-    N = src.shape[0]
-    h_src = pad(src)
-    h_dst = pad(dst)
-    
-    # Finding the transformation T that normalises the points
-    # Compute based on link given in lecture slides
-    m_src = np.mean(h_src, axis = 0)
-    s_src = np.sqrt(2) / np.std(h_src)
-    m_dst = np.mean(h_dst, axis = 0)
-    s_dst = np.sqrt(2) / np.std(h_dst)
-    
-    T_src = np.array([
-        [s_src,  0,       -s_src*m_src[0]],
-        [0,      s_src,   -s_src*m_src[1]],
-        [0,      0,       1]
-    ])
-    T_dst = np.array([
-        [s_dst,  0,       -s_dst*m_dst[0]],
-        [0,      s_dst,   -s_dst*m_dst[1]],
-        [0,      0,       1]
-    ])
-    
-    norm_src = np.dot(T_src, h_src.transpose()).transpose()
-    norm_dst = np.dot(T_dst, h_dst.transpose()).transpose()
-    
-    # Standard DLT
-    # Setting up matrix A
-    A = np.zeros((2*N, 9))
-    for i in range(N):
-        x_src, y_src = norm_src[i][0], norm_src[i][1]
-        x_dst, y_dst = norm_dst[i][0], norm_dst[i][1]
-        A[2*i] = [-x_src, -y_src, -1, 0, 0, 0, x_src*x_dst, y_src*x_dst, x_dst]
-        A[2*i+1] = [0, 0, 0, -x_src, -y_src, -1, x_src*y_dst, y_src*y_dst, y_dst]
-    
-    # Performing SVD on A
-    u, s, vh = np.linalg.svd(A, full_matrices = True)
-    H = vh[-1].reshape((3, 3))
-    
-    # Denormalising data
-    h_matrix = np.linalg.multi_dot([np.linalg.inv(T_dst), H, T_src])
-    
-    # Making H affine
-    h_matrix = h_matrix / h_matrix[2, 2]
+    # Null vector of A from its SVD; the full V is only needed when A has
+    # fewer rows than columns, i.e. for the minimal 4-point problem
+    def solve(A):
+        _, _, vh = np.linalg.svd(A, full_matrices=A.shape[1] < A.shape[2])
+        return vh[:, -1]
+
+    h_matrix = _normalized_dlt(np.asarray(src)[None], np.asarray(dst)[None], solve)[0]
     ### END YOUR CODE
 
     return h_matrix
 
+
+def compute_homography_batch(src, dst, normalize=True):
+    """Calculates many perspective transforms at once with the normalized DLT.
+
+    Every problem is solved through the eigenvector of A^T A with the smallest
+    eigenvalue, which for minimal 4-point problems is much cheaper than an SVD
+    of each A and vectorizes over the batch.
+
+    Args:
+        src (np.ndarray): Coordinates of points in the first images (K,N,2)
+        dst (np.ndarray): Corresponding coordinates of points in the second
+                          images (K,N,2)
+        normalize (bool): Normalize the points of each problem. Pass False
+                          when the points were already normalized once for
+                          the whole point set, as ransac does.
+
+    Returns:
+        h_matrices (np.ndarray): The 3x3 transformation matrices (K,3,3).
+                                 Degenerate problems give non-finite entries.
+    """
+    def solve(A):
+        AtA = np.swapaxes(A, 1, 2) @ A
+        finite = np.all(np.isfinite(AtA), axis=(1, 2))
+        h = np.full((A.shape[0], 9), np.nan)
+        if np.any(finite):
+            _, v = np.linalg.eigh(AtA[finite])
+            h[finite] = v[:, :, 0]
+        return h
+
+    return _normalized_dlt(src, dst, solve, normalize)
+
 def harris_corners(img, window_size=3, k=0.04):
     """
     Compute Harris corner response map. Follow the math equation
@@ -253,19 +421,166 @@ def simple_descriptor(patch):
     return feature
 
 
+_BRIEF_PATTERNS = {}
+
+
+def _brief_pattern(patch_size, n_bits=256, seed=4243):
+    """
+    Fixed test locations of the BRIEF descriptor for a patch size.
+
+    Locations are drawn from an isotropic Gaussian around the patch centre
+    with a standard deviation of patch_size / 5, as in the BRIEF paper, and
+    clipped to the patch.
+
+    Returns:
+        pattern: integer offsets (dy1, dx1, dy2, dx2) of shape (n_bits, 4)
+            relative to the keypoint
+    """
+    key = (patch_size, n_bits, seed)
+    if key not in _BRIEF_PATTERNS:
+        rng = np.random.RandomState(seed)
+        lo, hi = -(patch_size // 2), (patch_size + 1) // 2 - 1
+        pattern = np.round(rng.normal(0, patch_size / 5., size=(n_bits, 4)))
+        _BRIEF_PATTERNS[key] = np.clip(pattern, lo, hi).astype(np.intp)
+    return _BRIEF_PATTERNS[key]
+
+
+def brief_descriptor(patch):
+    """
+    Describe the patch with BRIEF binary intensity comparisons.
+
+    The patch is smoothed, and each of 256 fixed pairs of pixels contributes
+    one bit telling whether the first pixel is darker than the second. The
+    bits are packed 8 per byte.
+
+    Args:
+        patch: grayscale image patch of shape (h, w)
+
+    Returns:
+        feature: uint8 array of shape (32, )
+    """
+    h, w = patch.shape
+    smoothed = filters.gaussian(patch.astype(np.float64), sigma=2, mode='nearest')
+    return _brief_tests(smoothed, np.array([[h // 2, w // 2]]), h)[0]
+
+
+# Descriptor functions may declare the metric their features are compared by
+brief_descriptor.metric = 'hamming'
+
+
+def descriptor_metric(desc_func):
+    """
+    Args:
+        desc_func: descriptor function such as simple_descriptor
+
+    Returns:
+        metric: the `metric` attribute of desc_func, or 'euclidean'
+    """
+    return getattr(desc_func, 'metric', 'euclidean')
+
+
+def _brief_tests(image, keypoints, patch_size, n_bits=256):
+    """Packed BRIEF bits of shape (K, n_bits // 8) for all keypoints of a smoothed image."""
+    H, W = image.shape
+    pattern = _brief_pattern(patch_size, n_bits)
+    keypoints = np.asarray(keypoints, dtype=np.intp).reshape(-1, 2)
+    y1 = np.clip(keypoints[:, 0, None] + pattern[:, 0], 0, H - 1)
+    x1 = np.clip(keypoints[:, 1, None] + pattern[:, 1], 0, W - 1)
+    y2 = np.clip(keypoints[:, 0, None] + pattern[:, 2], 0, H - 1)
+    x2 = np.clip(keypoints[:, 1, None] + pattern[:, 3], 0, W - 1)
+    return np.packbits(image[y1, x1] < image[y2, x2], axis=1)
+
+
+def brief_describe_keypoints(image, keypoints, patch_size=16):
+    """
+    Describe all keypoints with BRIEF in one pass over a smoothed image.
+
+    Args:
+        image: grayscale image of shape (H, W)
+        keypoints: 2D array containing a keypoint (y, x) in each row
+        patch_size: size of a square patch at each keypoint
+
+    Returns:
+        desc: uint8 array of shape (K, 32) holding the packed bits
+    """
+    smoothed = filters.gaussian(image.astype(np.float64), sigma=2, mode='nearest')
+    return _brief_tests(smoothed, keypoints, patch_size)
+
+
+# ...and a `batch` function describing all keypoints of an image at once
+brief_descriptor.batch = brief_describe_keypoints
+
+
+def hamming_distances(desc1, desc2):
+    """
+    Hamming distances between packed binary descriptors.
+
+    The bits are unpacked to -1/+1 values so that the number of differing
+    bits comes from one matrix product: d(a, b) = (n_bits - a.b) / 2
+
+    Args:
+        desc1: uint8 array of shape (M, B)
+        desc2: uint8 array of shape (N, B)
+
+    Returns:
+        dists: float32 array of shape (M, N)
+    """
+    return _distance_function(desc2, 'hamming')(desc1)
+
+
+def _signed_bits(desc):
+    """Unpacked bits of uint8 descriptors as float32 -1/+1 values."""
+    bits = np.unpackbits(np.asarray(desc, dtype=np.uint8), axis=1).astype(np.float32)
+    bits *= 2
+    bits -= 1
+    return bits
+
+
+def _distance_function(desc2, metric):
+    """
+    Prepare desc2 once for computing distances from many chunks of queries.
+
+    Args:
+        desc2: an array of shape (N, P)
+        metric: 'euclidean', or 'hamming' for packed binary uint8 descriptors
+
+    Returns:
+        dist: function mapping queries of shape (M, P) to distances of shape (M, N)
+    """
+    if metric == 'hamming':
+        bits2_t = np.ascontiguousarray(_signed_bits(desc2).T)
+        n_bits = bits2_t.shape[0]
+
+        def dist(desc1):
+            d = _signed_bits(desc1).dot(bits2_t)
+            d -= n_bits
+            d *= -0.5
+            return d
+        return dist
+    if metric == 'euclidean':
+        return lambda desc1: cdist(desc1, desc2)
+    raise ValueError("metric must be 'euclidean' or 'hamming', got %r" % (metric,))
+
+
 def describe_keypoints(image, keypoints, desc_func, patch_size=16):
     """
     Args:
         image: grayscale image of shape (H, W)
         keypoints: 2D array containing a keypoint (y, x) in each row
         desc_func: function that takes in an image patch and outputs
-            a 1D feature vector describing the patch
+            a 1D feature vector describing the patch. If it has a `batch`
+            attribute, batch(image, keypoints, patch_size=patch_size) is
+            called instead to describe all keypoints at once
         patch_size: size of a square patch at each keypoint
                 
     Returns:
         desc: array of features describing the keypoints
     """
 
+    batch = getattr(desc_func, 'batch', None)
+    if batch is not None:
+        return batch(image, keypoints, patch_size=patch_size)
+
     image.astype(np.float32)
     desc = []
 
@@ -276,7 +591,63 @@ def describe_keypoints(image, keypoints, desc_func, patch_size=16):
         desc.append(desc_func(patch))
     return np.array(desc)
 
-def match_descriptors(desc1, desc2, threshold=0.5):
+def _chunk_rows(n_cols, chunk_bytes):
+    """Rows of an n_cols wide distance matrix that fit in chunk_bytes."""
+    # float64 distances, intp argpartition indices and one temporary per entry
+    return max(1, int(chunk_bytes // (24 * max(n_cols, 1))))
+
+
+def _nearest_two(desc1, desc2, chunk_bytes=64 << 20, method='brute', eps=0.0,
+                 metric='euclidean'):
+    """
+    Find the two nearest neighbours in desc2 of every descriptor in desc1.
+
+    Args:
+        desc1: an array of shape (M, P)
+        desc2: an array of shape (N, P), N >= 2
+        chunk_bytes: memory budget of one chunk; rows of desc1 are compared
+            against desc2 in chunks of about chunk_bytes / (24 N) rows
+        method: 'brute' for an exact chunked search, 'kdtree' for a KD-tree
+            index over desc2
+        eps: approximation factor of the KD-tree search; the k-th returned
+            neighbour is no further than (1 + eps) times the true one
+        metric: 'euclidean', or 'hamming' for packed binary descriptors,
+            which are always searched by brute force
+
+    Returns:
+        idx: array of shape (M, 2) with the indices of the closest and
+            second-closest descriptors in desc2
+        dist: array of shape (M, 2) with the corresponding distances
+    """
+    M = desc1.shape[0]
+    idx = np.empty((M, 2), dtype=np.intp)
+    dist = np.empty((M, 2))
+    chunk_size = _chunk_rows(desc2.shape[0], chunk_bytes)
+
+    if method == 'kdtree':
+        tree = cKDTree(desc2)
+        for s in range(0, M, chunk_size):
+            dist[s:s+chunk_size], idx[s:s+chunk_size] = \
+                tree.query(desc1[s:s+chunk_size], k=2, eps=eps)
+        return idx, dist
+
+    distances = _distance_function(desc2, metric)
+    for s in range(0, M, chunk_size):
+        d = distances(desc1[s:s+chunk_size])
+        rows = np.arange(d.shape[0])
+        # Two argmin passes are much cheaper than a partition of every row
+        first = d.argmin(axis=1)
+        idx[s:s+chunk_size, 0] = first
+        dist[s:s+chunk_size, 0] = d[rows, first]
+        d[rows, first] = np.inf
+        second = d.argmin(axis=1)
+        idx[s:s+chunk_size, 1] = second
+        dist[s:s+chunk_size, 1] = d[rows, second]
+    return idx, dist
+
+
+def match_descriptors(desc1, desc2, threshold=0.5, cross_check=False,
+                      method='auto', chunk_bytes=64 << 20, eps=0.5, metric='euclidean'):
     """
     Match the feature descriptors by finding distances between them. A match is formed 
     when the distance to the closest vector is much smaller than the distance to the 
@@ -286,41 +657,108 @@ def match_descriptors(desc1, desc2, threshold=0.5):
     Args:
         desc1: an array of shape (M, P) holding descriptors of size P about M keypoints
         desc2: an array of shape (N, P) holding descriptors of size P about N keypoints
+        threshold: maximum ratio of closest to second-closest distance
+        cross_check: if True, only keep matches (i, j) where desc1[i] is also
+            the closest descriptor to desc2[j]
+        method: 'brute' for an exact chunked search, 'kdtree' for an
+            approximate KD-tree search, or 'auto' to use the KD-tree for
+            short descriptors (P <= 32) once M x N exceeds 10^8; KD-trees
+            are slower than brute force for longer descriptors such as SIFT.
+        chunk_bytes: memory budget of the distance matrix of one chunk
+        eps: approximation factor of the KD-tree search
+        metric: 'euclidean', or 'hamming' for packed binary uint8 descriptors
+            such as brief_descriptor's (see descriptor_metric); Hamming
+            matching always uses the brute-force search
         
     Returns:
         matches: an array of shape (Q, 2) where each row holds the indices of one pair 
         of matching descriptors
     """
-    matches = []
-    
-    N = desc1.shape[0]
-    dists = cdist(desc1, desc2)
-    printed = False
+    desc1 = np.asarray(desc1)
+    desc2 = np.asarray(desc2)
+    M, N = desc1.shape[0], desc2.shape[0]
+    if M == 0 or N < 2:
+        return np.zeros((0, 2), dtype=np.intp)
+    if metric == 'hamming':
+        method = 'brute'
+    elif method == 'auto':
+        method = 'kdtree' if M * N > 1e8 and desc1.shape[1] <= 32 else 'brute'
 
     ### YOUR CODE HERE
-    
-    for i in range(N):
-        dist_1_2 = dists[i]
-        
-        # Distance to the closest vector
-        a_j = dist_1_2.argmin()
-        a = dist_1_2[a_j]
-        dist_1_2[a_j] = float("inf")
-        
-        # Distance to the second-closest vector
-        b_j = dist_1_2.argmin()
-        b = dist_1_2[b_j]
-        
-        ratio = a / b
-        if ratio < threshold:
-            matches.append([i, a_j])
-    matches = np.array(matches)
-    
+    idx, dist = _nearest_two(desc1, desc2, chunk_bytes, method, eps, metric)
+
+    # Ratio test, written as a product so that a zero second distance is rejected
+    keep = dist[:, 0] < threshold * dist[:, 1]
+    matches = np.stack([np.nonzero(keep)[0], idx[keep, 0]], axis=1)
+
+    if cross_check and len(matches):
+        # Reverse nearest neighbour of each matched desc2 entry
+        targets = np.unique(matches[:, 1])
+        if method == 'kdtree':
+            _, back = cKDTree(desc1).query(desc2[targets], k=1, eps=eps)
+        else:
+            chunk_size = _chunk_rows(M, chunk_bytes)
+            distances = _distance_function(desc1, metric)
+            back = np.concatenate([
+                distances(desc2[targets[s:s+chunk_size]]).argmin(axis=1)
+                for s in range(0, len(targets), chunk_size)])
+        reverse = np.full(N, -1, dtype=np.intp)
+        reverse[targets] = back
+        matches = matches[reverse[matches[:, 1]] == matches[:, 0]]
     ### END YOUR CODE
     
     return matches
 
-def ransac(keypoints1, keypoints2, matches, sampling_ratio=0.5, n_iters=500, threshold=20):
+def _score_homographies(h_matrices, src, dst, threshold):
+    """
+    Count the inliers of many homography hypotheses at once.
+
+    Args:
+        h_matrices: array of shape (K, 3, 3); h_matrices[k] maps src to dst
+        src: points of shape (N, 2)
+        dst: points of shape (N, 2), or already padded of shape (N, 3)
+        threshold: squared distance in src below which a match is an inlier
+
+    Returns:
+        inliers: boolean array of shape (K, N)
+    """
+    K = h_matrices.shape[0]
+    inliers = np.zeros((K, src.shape[0]), dtype=bool)
+
+    # Degenerate samples give singular or non-finite hypotheses; skip them
+    finite = np.all(np.isfinite(h_matrices), axis=(1, 2))
+    det = np.zeros(K)
+    det[finite] = np.linalg.det(h_matrices[finite])
+    ok = np.abs(det) > 1e-12
+    if not np.any(ok):
+        return inliers
+
+    # (K, 3, 3) x (3, N): project dst back into src
+    projected = transform_points(dst, np.linalg.inv(h_matrices[ok]))
+    dist = np.sum(np.square(projected - src[None]), axis=2)
+    inliers[ok] = dist < threshold
+    return inliers
+
+
+def _random_state(seed):
+    """
+    Args:
+        seed: None, an int, an np.random.RandomState or the np.random module
+
+    Returns:
+        rng: object with the np.random.RandomState methods; the np.random
+            module itself if seed is None, so that np.random.seed makes the
+            results reproducible
+    """
+    if seed is None or seed is np.random:
+        return np.random
+    if isinstance(seed, np.random.RandomState):
+        return seed
+    return np.random.RandomState(seed)
+
+
+def ransac(keypoints1, keypoints2, matches, sampling_ratio=None, n_iters=500, threshold=20,
+           confidence=0.99, batch_size=64, seed=None):
     """
     Use RANSAC to find a robust affine transformation
 
@@ -330,70 +768,104 @@ def ransac(keypoints1, keypoints2, matches, sampling_ratio=0.5, n_iters=500, thr
         4. Keep the largest set of inliers
         5. Re-compute least-squares estimate on all of the inliers
 
+    Hypotheses are generated and scored in batches of `batch_size`. After each
+    batch the number of iterations still needed is re-estimated from the best
+    inlier ratio w seen so far as log(1 - confidence) / log(1 - w^s), where s
+    is the sample size, and the loop stops once it has been reached.
+
     Args:
         keypoints1: M1 x 2 matrix, each row is a point
         keypoints2: M2 x 2 matrix, each row is a point
         matches: N x 2 matrix, each row represents a match
             [index of keypoint1, index of keypoint 2]
-        n_iters: the number of iterations RANSAC will run
+        sampling_ratio: fraction of the matches used to fit each hypothesis;
+            if None, minimal samples of 4 matches are used
+        n_iters: the maximum number of iterations RANSAC will run
         threshold: the number of threshold to find inliers
+        confidence: probability of having drawn at least one outlier-free
+            sample at which the iterations stop early
+        batch_size: number of hypotheses scored together
+        seed: seed or np.random.RandomState used to draw the samples; the
+            global numpy random state is used if None
 
     Returns:
         H: a robust estimation of affine transformation from keypoints2 to
         keypoints 1
+        inliers: the inlier matches; empty, with H the identity, when fewer
+        than 4 inliers were found, so callers must check it before using H
     """
     N = matches.shape[0]
-    n_samples = int(N * sampling_ratio)
+    if sampling_ratio is None:
+        n_samples = 4
+    else:
+        n_samples = max(4, int(N * sampling_ratio))
+    rng = _random_state(seed)
+
+    if N < 4:
+        return np.eye(3), matches[:0]
 
     # Please note that coordinates are in the format (y, x)
-    matched1 = pad(keypoints1[matches[:,0]])
-    matched2 = pad(keypoints2[matches[:,1]])
     matched1_unpad = keypoints1[matches[:,0]]
     matched2_unpad = keypoints2[matches[:,1]]
 
-    max_inliers = np.zeros(N)
+    max_inliers = np.zeros(N, dtype=bool)
     n_inliers = 0
 
     # RANSAC iteration start
     ### YOUR CODE HERE    
     
     # Flip x and y coordinates
-    matched1[:, [0,1]] = matched1[:, [1,0]]
-    matched2[:, [0,1]] = matched2[:, [1,0]]
-    matched1_unpad[:, [0,1]] = matched1_unpad[:, [1,0]]
-    matched2_unpad[:, [0,1]] = matched2_unpad[:, [1,0]]
+    matched1_unpad = matched1_unpad[:, ::-1].astype(np.float64)
+    matched2_unpad = matched2_unpad[:, ::-1].astype(np.float64)
+
+    # Normalize both point sets once; every hypothesis is fitted to the
+    # normalized points and mapped back to pixels with the same transforms
+    T1 = normalization_transforms(matched1_unpad)
+    T2 = normalization_transforms(matched2_unpad)
+    norm1 = transform_points(matched1_unpad, T1)
+    norm2 = transform_points(matched2_unpad, T2)
+    T2_inv = invert_normalization(T2)
+    # Every batch scores against the same points; pad them only once
+    matched2_h = to_homogeneous(matched2_unpad)
     
     # Ransac Loop
-    for _ in range(n_iters):
-        # Randomly pick n_samples
-        rand_indices = np.random.choice(N, n_samples)
-        rand_1 = matched1_unpad[rand_indices]
-        rand_2 = matched2_unpad[rand_indices]
-        
-        # Compute H using these correspondences
-        iter_H = compute_homography(rand_1, rand_2)
-        
-        # Count the number of inliers
-        iter_n_inliers = 0
-        iter_inliers = np.zeros(N)
-        for i in range(N):
-            p1 = matched1_unpad[i]
-            p2 = matched2[i]
-            p2_prime = np.dot(np.linalg.inv(iter_H), p2.transpose()).transpose()
-            p2_prime = p2_prime[:2] / p2_prime[-1]
-            dist = np.sum(np.square(p1 - p2_prime))
-            
-            if dist < threshold:
-                iter_n_inliers += 1
-                iter_inliers[i] = 1
+    done = 0
+    required = n_iters
+    while done < required:
+        K = min(batch_size, required - done)
+
+        # Draw K samples of n_samples distinct matches each
+        rand_indices = np.argpartition(rng.rand(K, N), n_samples - 1, axis=1)[:, :n_samples]
+
+        # Compute H for every sample
+        iter_H = compute_homography_batch(norm1[rand_indices], norm2[rand_indices],
+                                          normalize=False)
+        iter_H = T2_inv @ iter_H @ T1
+
+        # Count the number of inliers of every hypothesis
+        iter_inliers = _score_homographies(iter_H, matched1_unpad, matched2_h, threshold)
+        counts = iter_inliers.sum(axis=1)
 
         # Store the max number of inliers
-        if iter_n_inliers > n_inliers:
-            n_inliers = iter_n_inliers
-            max_inliers = iter_inliers
+        best = np.argmax(counts)
+        if counts[best] > n_inliers:
+            n_inliers = counts[best]
+            max_inliers = iter_inliers[best]
+        done += K
+
+        # Adapt the number of iterations to the inlier ratio seen so far
+        w = n_inliers / N
+        if w >= 1:
+            break
+        if w > 0:
+            p_good = w ** n_samples
+            if p_good > 0:
+                needed = np.log(1 - confidence) / np.log1p(-p_good)
+                required = min(n_iters, int(np.ceil(needed)))
     
     # Recomputing H with all of the max inliers
-    max_inliers = max_inliers.astype(bool)
+    if n_inliers < 4:
+        return np.eye(3), matches[:0]
     max_src = matched1_unpad[max_inliers]
     max_dst = matched2_unpad[max_inliers]
     H = compute_homography(max_src, max_dst)
@@ -442,35 +914,165 @@ def sift_descriptor(patch):
     
     dx = filters.sobel_v(patch)
     dy = filters.sobel_h(patch)
-    histogram = np.zeros((4,4,8))
-    
+
     ### YOUR CODE HERE
-    # get gradient magnitudes and orientation of each pixel
-    # using the formulas in lab pdf
-    m = np.sqrt(dx ** 2 + dy ** 2)
-    t = np.arctan2(dy, dx)  # Array of angles in radians, in the range [-pi, pi].
+    h, w = patch.shape
+    magnitude = np.sqrt(dx ** 2 + dy ** 2)
+    theta = np.arctan2(dy, dx)  # Array of angles in radians, in the range [-pi, pi].
+    feature = _sift_histograms(magnitude, theta, np.array([[h // 2, w // 2]]),
+                               patch_size=h)[0]
+    # END YOUR CODE
+    
+    return feature
 
-    for r in range(0, 16, 4):
-        for c in range(0, 16, 4):
-            magnitude = m[r:r+4, c:c+4]
-            theta = t[r:r+4, c:c+4]
 
-            # get histogram of local distribution of gradient magnitudes in 8 orientations
-            local_histogram, _ = np.histogram(theta, bins=8, range=(-np.pi, np.pi),
-                                              weights=magnitude)
+def _sift_histograms(magnitude, theta, keypoints, patch_size=16, n_cells=4,
+                     n_bins=8, clip=0.2):
+    """
+    Accumulate SIFT-like histograms for all keypoints at once.
 
-            # normalize histogram
-            local_histogram = local_histogram / np.sum(local_histogram)
+    Every gradient sample in a keypoint's patch is soft-binned into the 2
+    nearest cells along each spatial axis and the 2 nearest orientation bins,
+    for 8 weighted contributions. The histograms are then normalized to unit
+    length, clipped at `clip` and normalized again.
 
-            histogram[r//4][c//4] = local_histogram
+    Args:
+        magnitude: gradient magnitude of shape (H, W)
+        theta: gradient orientation in radians of shape (H, W)
+        keypoints: 2D array containing a keypoint (y, x) in each row
+        patch_size: size of a square patch at each keypoint
+        n_cells: number of spatial cells along each side of the patch
+        n_bins: number of orientation bins in each cell
+        clip: value at which normalized histogram entries are clipped
 
-    feature = histogram.reshape(128)
-    # END YOUR CODE
-    
-    return feature
+    Returns:
+        desc: array of shape (K, n_cells * n_cells * n_bins)
+    """
+    H, W = magnitude.shape
+    K = len(keypoints)
+    keypoints = np.asarray(keypoints, dtype=np.intp).reshape(K, 2)
+    offsets = np.arange(patch_size) - patch_size // 2
+
+    # Gather (K, patch_size, patch_size) windows; samples outside the image
+    # are clamped to the border and given zero weight
+    rows = keypoints[:, 0, None] + offsets
+    cols = keypoints[:, 1, None] + offsets
+    valid = (((rows >= 0) & (rows < H))[:, :, None] &
+             ((cols >= 0) & (cols < W))[:, None, :])
+    rows = np.clip(rows, 0, H - 1)[:, :, None]
+    cols = np.clip(cols, 0, W - 1)[:, None, :]
+    mag = magnitude[rows, cols] * valid
+    ori = theta[rows, cols]
+
+    # Gaussian weighting centred on the keypoint
+    sigma = patch_size / 2
+    d = np.arange(patch_size) - (patch_size - 1) / 2
+    g = np.exp(-d ** 2 / (2 * sigma ** 2))
+    mag = mag * np.outer(g, g)
+
+    # Continuous cell and orientation coordinates of every sample
+    cell = (np.arange(patch_size) + 0.5) * n_cells / patch_size - 0.5
+    c0 = np.floor(cell).astype(np.intp)
+    dc = cell - c0
+    o = (ori + np.pi) * n_bins / (2 * np.pi)
+    o0 = np.floor(o).astype(np.intp)
+    do = o - o0
+
+    desc = np.zeros(K * n_cells * n_cells * n_bins)
+    base = np.arange(K)[:, None, None] * (n_cells * n_cells * n_bins)
+    for ry in (0, 1):
+        cy = c0 + ry
+        wy = dc if ry else 1 - dc
+        wy = np.where((cy >= 0) & (cy < n_cells), wy, 0)
+        for rx in (0, 1):
+            cx = c0 + rx
+            wx = dc if rx else 1 - dc
+            wx = np.where((cx >= 0) & (cx < n_cells), wx, 0)
+            spatial = np.outer(wy, wx)
+            cell_idx = (np.clip(cy, 0, n_cells - 1)[:, None] * n_cells +
+                        np.clip(cx, 0, n_cells - 1)[None, :]) * n_bins
+            w_cell = mag * spatial
+            for ro in (0, 1):
+                wo = do if ro else 1 - do
+                idx = base + cell_idx + (o0 + ro) % n_bins
+                desc += np.bincount(idx.ravel(), weights=(w_cell * wo).ravel(),
+                                    minlength=desc.size)
+    desc = desc.reshape(K, n_cells * n_cells * n_bins)
+
+    # Normalize -> clip -> normalize, dividing by 1 where a norm is zero
+    norm = np.linalg.norm(desc, axis=1, keepdims=True)
+    desc /= np.where(norm > 0, norm, 1)
+    np.minimum(desc, clip, out=desc)
+    norm = np.linalg.norm(desc, axis=1, keepdims=True)
+    desc /= np.where(norm > 0, norm, 1)
+
+    return desc
+
+
+def sift_describe_keypoints(image, keypoints, patch_size=16):
+    """
+    Describe all keypoints with the SIFT-like descriptor in one pass.
 
+    Gradients are computed once over the whole image instead of once per
+    patch, and histograms for every keypoint are accumulated together.
+
+    Args:
+        image: grayscale image of shape (H, W)
+        keypoints: 2D array containing a keypoint (y, x) in each row
+        patch_size: size of a square patch at each keypoint
 
-def linear_blend(img1_warped, img2_warped):
+    Returns:
+        desc: array of shape (K, 128) describing the keypoints
+    """
+    image = image.astype(np.float64)
+    dx = filters.sobel_v(image)
+    dy = filters.sobel_h(image)
+    magnitude = np.sqrt(dx ** 2 + dy ** 2)
+    theta = np.arctan2(dy, dx)
+    return _sift_histograms(magnitude, theta, keypoints, patch_size=patch_size)
+
+
+sift_descriptor.batch = sift_describe_keypoints
+
+
+def _gaussian_pyramid(img, levels):
+    """Gaussian pyramid of a float32 image with `levels` reductions."""
+    pyramid = [img]
+    for _ in range(levels):
+        pyramid.append(cv2.pyrDown(pyramid[-1]))
+    return pyramid
+
+
+def _laplacian_pyramid(img, levels):
+    """Laplacian pyramid of a float32 image; the last level is the residual."""
+    gaussian = _gaussian_pyramid(img, levels)
+    pyramid = []
+    for fine, coarse in zip(gaussian[:-1], gaussian[1:]):
+        pyramid.append(fine - cv2.pyrUp(coarse, dstsize=(fine.shape[1], fine.shape[0])))
+    pyramid.append(gaussian[-1])
+    return pyramid
+
+
+def _multiband_strip(strip1, strip2, weights, levels):
+    """Blend two aligned float32 strips band by band with a weight mask for strip1."""
+    lap1 = _laplacian_pyramid(strip1, levels)
+    lap2 = _laplacian_pyramid(strip2, levels)
+    masks = _gaussian_pyramid(weights, levels)
+
+    blended = None
+    for l1, l2, m in reversed(list(zip(lap1, lap2, masks))):
+        if l1.ndim == 3:
+            m = m[..., None]
+        band = l2 + m * (l1 - l2)
+        if blended is None:
+            blended = band
+        else:
+            blended = cv2.pyrUp(blended, dstsize=(band.shape[1], band.shape[0])) + band
+    return blended
+
+
+def linear_blend(img1_warped, img2_warped, multiband=False, levels=4, out=None,
+                 img2_cols=None):
     """
     Linearly blend img1_warped and img2_warped by following the steps:
 
@@ -480,33 +1082,775 @@ def linear_blend(img1_warped, img2_warped):
     3. Apply the weight matrices to their corresponding images
     4. Combine the images
 
+    Only the columns between the margins are blended; elsewhere each output
+    pixel is copied from whichever image covers it. With `multiband`, the
+    overlap strip is instead blended band by band over Laplacian pyramids,
+    with the seam in the middle of the strip. Weights and pyramids are only
+    built over the strip, and only the columns of `img2_cols` are read from
+    img2_warped, so with `out=img1_warped` the cost follows the size of
+    image 2 rather than that of the output space.
+
     Args:
         img1_warped: Refernce image warped into output space
         img2_warped: Transformed image warped into output space
+        multiband: Use multi-band blending in the overlap strip
+        levels: Maximum number of pyramid levels of the multi-band blend;
+            fewer are used for narrow strips
+        out: Optional float array of the output shape to write the result
+            into; may be img1_warped itself
+        img2_cols: Optional (start, stop) columns outside of which
+            img2_warped is empty; defaults to the full width
 
     Returns:
         merged: Merged image in output space
     """
-    out_H, out_W = img1_warped.shape # Height and width of output space
-    img1_mask = (img1_warped != 0)  # Mask == 1 inside the image
-    img2_mask = (img2_warped != 0)  # Mask == 1 inside the image
+    out_H, out_W = img1_warped.shape[:2] # Height and width of output space
+    c0, c1 = (0, out_W) if img2_cols is None else img2_cols
+
+    def covered(img, cols):
+        # Mask == 1 inside the image
+        mask = img[:, cols] != 0
+        return mask.any(axis=2) if mask.ndim == 3 else mask
+
+    img1_row = covered(img1_warped[out_H//2:out_H//2+1], slice(None))[0]
+    img2_row = covered(img2_warped[out_H//2:out_H//2+1], slice(c0, c1))[0]
 
     # Find column of middle row where warped image 1 ends
     # This is where to end weight mask for warped image 1
-    right_margin = out_W - np.argmax(np.fliplr(img1_mask)[out_H//2, :].reshape(1, out_W), 1)[0]
+    right_margin = out_W - np.argmax(img1_row[::-1])
 
     # Find column of middle row where warped image 2 starts
     # This is where to start weight mask for warped image 2
-    left_margin = np.argmax(img2_mask[out_H//2, :].reshape(1, out_W), 1)[0]
+    left_margin = c0 + np.argmax(img2_row)
 
     ### YOUR CODE HERE
-    raise NotImplementedError() # Delete this line
+    if out is None:
+        merged = img1_warped.astype(np.float32)
+    else:
+        merged = out
+        if merged is not img1_warped:
+            merged[...] = img1_warped
+
+    # Left of the strip, take image 2 only where image 1 is empty
+    cols = slice(c0, max(c0, min(left_margin, right_margin)))
+    take2 = covered(img2_warped, cols) & ~covered(merged, cols)
+    merged[:, cols][take2] = img2_warped[:, cols][take2]
+
+    # Right of the strip, take image 2 wherever it is defined
+    cols = slice(max(c0, right_margin), max(c0, right_margin, c1))
+    take2 = covered(img2_warped, cols)
+    merged[:, cols][take2] = img2_warped[:, cols][take2]
+
+    if left_margin < right_margin:
+        cols = slice(left_margin, right_margin)
+        img1_mask = covered(merged, cols)
+        img2_mask = covered(img2_warped, cols)
+        both = img1_mask & img2_mask
+        strip1 = merged[:, cols].astype(np.float32)
+        strip2 = img2_warped[:, cols].astype(np.float32)
+        only2 = img2_mask & ~img1_mask
+        strip1[only2] = strip2[only2]
+        only1 = img1_mask & ~img2_mask
+        strip2[only1] = strip1[only1]
+
+        width = right_margin - left_margin
+        if multiband:
+            weights = np.zeros(strip1.shape[:2], dtype=np.float32)
+            weights[:, :width // 2] = 1
+            # The coarsest band blends over about 2**levels columns around the
+            # seam; keep that inside the strip so its edges meet each image
+            strip_levels = min(levels, max(0, int(np.log2(width)) - 2))
+            blended = _multiband_strip(strip1, strip2, weights, strip_levels)
+        else:
+            # Weight of image 1 falls from 1 to 0 across the strip
+            ramp = np.linspace(1, 0, width, dtype=np.float32)
+            if strip1.ndim == 3:
+                ramp = ramp[:, None]
+            blended = strip2 + ramp * (strip1 - strip2)
+
+        # Pixels covered by one image only keep that image's value
+        blended[~both] = strip1[~both]
+        merged[:, cols] = blended
     ### END YOUR CODE
 
     return merged
 
 
-def stitch_multiple_images(imgs, desc_func=simple_descriptor, patch_size=5):
+def chain_homographies(h_matrices, ref):
+    """
+    Chain pairwise homographies of an ordered image chain to a reference frame.
+
+    Args:
+        h_matrices: list of length m-1; h_matrices[i] maps (x, y) points in
+            image i to image i+1
+        ref: index of the reference image
+
+    Returns:
+        transforms: list of length m; transforms[i] maps (x, y) points in
+            image i to the reference image
+    """
+    m = len(h_matrices) + 1
+    transforms = [None] * m
+    transforms[ref] = np.eye(3)
+    for i in range(ref - 1, -1, -1):
+        transforms[i] = transforms[i + 1].dot(h_matrices[i])
+    for i in range(ref + 1, m):
+        transforms[i] = transforms[i - 1].dot(np.linalg.inv(h_matrices[i - 1]))
+    return [T / T[2, 2] for T in transforms]
+
+
+def feather_weights(shape):
+    """
+    Weight map that falls off linearly from the centre of an image to zero
+    at its border.
+
+    Args:
+        shape: (H, W) of the image
+
+    Returns:
+        weights: float32 array of shape (H, W) with values in (0, 1]
+    """
+    H, W = shape[:2]
+    ramp_y = np.minimum(np.arange(1, H + 1), np.arange(H, 0, -1)).astype(np.float32)
+    ramp_x = np.minimum(np.arange(1, W + 1), np.arange(W, 0, -1)).astype(np.float32)
+    return np.outer(ramp_y / ramp_y.max(), ramp_x / ramp_x.max())
+
+
+def compose_panorama(imgs, transforms, ref, blend='feather'):
+    """
+    Warp every image once into a shared output canvas and blend them.
+
+    The canvas bounds come from the warped image corners. Only a weighted sum
+    and a weight total are kept at canvas size, so memory does not grow with
+    the number of images, and each image is only rendered over its own
+    footprint.
+
+    Args:
+        imgs: list of m images
+        transforms: list of m homographies; transforms[i] maps (x, y) points
+            in imgs[i] to the reference frame
+        ref: index of the reference image
+        blend: 'feather' to weight every image by its distance to its border,
+            or 'linear' or 'multiband' to merge the images from left to right
+            with linear_blend
+
+    Returns:
+        panorama: float32 image covering all warped images
+    """
+    others = [i for i in range(len(imgs)) if i != ref]
+    output_shape, offset = get_output_space(imgs[ref], [imgs[i] for i in others],
+                                            [transforms[i] for i in others],
+                                            projective=True)
+    out_H, out_W = output_shape
+    shift = np.array([[1, 0, -offset[1]],
+                      [0, 1, -offset[0]],
+                      [0, 0, 1]], dtype=np.float64)
+
+    if blend in ('linear', 'multiband'):
+        return _compose_linear(imgs, [shift.dot(T) for T in transforms], (out_H, out_W),
+                               multiband=blend == 'multiband')
+    if blend != 'feather':
+        raise ValueError("blend must be 'feather', 'linear' or 'multiband', got %r" % (blend,))
+
+    acc = np.zeros((out_H, out_W) + imgs[0].shape[2:], dtype=np.float32)
+    weight_sum = np.zeros((out_H, out_W), dtype=np.float32)
+    for img, T in zip(imgs, transforms):
+        M = shift.dot(T)
+        # Warp the image and its weights together, only over its footprint
+        x0, y0, x1, y1 = warp_footprint(img.shape, M)
+        x0, y0 = max(x0, 0), max(y0, 0)
+        x1, y1 = min(x1, out_W), min(y1, out_H)
+        if x0 >= x1 or y0 >= y1:
+            continue
+        stacked = np.dstack([img.astype(np.float32), feather_weights(img.shape)])
+        warped = warp_perspective_tiled(stacked, M, (x0, y0, x1, y1))
+        weights = warped[..., -1]
+        weight_sum[y0:y1, x0:x1] += weights
+        if acc.ndim == 3:
+            acc[y0:y1, x0:x1] += warped[..., :-1] * weights[..., None]
+        else:
+            acc[y0:y1, x0:x1] += warped[..., 0] * weights
+
+    if acc.ndim == 3:
+        weight_sum = weight_sum[..., None]
+    np.divide(acc, weight_sum, out=acc, where=weight_sum > 0)
+    return acc
+
+
+def _compose_linear(imgs, h_matrices, output_shape, multiband=False):
+    """
+    Merge warped images into the canvas from left to right with linear_blend.
+
+    Args:
+        imgs: list of m images
+        h_matrices: list of m homographies mapping (x, y) points in imgs[i]
+            to the canvas
+        output_shape: (H, W) of the canvas
+        multiband: passed on to linear_blend
+
+    Returns:
+        panorama: float32 image of shape output_shape
+    """
+    out_H, out_W = output_shape
+    panorama = np.zeros(output_shape + imgs[0].shape[2:], dtype=np.float32)
+    # Only the footprint of the image being merged is ever non-zero
+    warped = np.zeros_like(panorama)
+
+    footprints = []
+    for img, M in zip(imgs, h_matrices):
+        x0, y0, x1, y1 = warp_footprint(img.shape, M)
+        footprints.append((max(x0, 0), max(y0, 0), min(x1, out_W), min(y1, out_H)))
+
+    first = True
+    for i in sorted(range(len(imgs)), key=lambda i: footprints[i][0]):
+        x0, y0, x1, y1 = footprints[i]
+        if x0 >= x1 or y0 >= y1:
+            continue
+        region = warp_perspective_tiled(imgs[i], h_matrices[i], footprints[i])
+        if first:
+            panorama[y0:y1, x0:x1] = region
+            first = False
+            continue
+        warped[y0:y1, x0:x1] = region
+        linear_blend(panorama, warped, multiband=multiband, out=panorama, img2_cols=(x0, x1))
+        warped[y0:y1, x0:x1] = 0
+    return panorama
+
+
+def select_keypoints(keypoints, response, cell_size=32, per_cell=None,
+                     max_keypoints=None):
+    """
+    Spread keypoints over the image and bound their number.
+
+    The image is divided into square cells of `cell_size` pixels and only the
+    `per_cell` strongest keypoints of each cell are kept, so that textured
+    regions cannot take up the whole budget. The `max_keypoints` strongest of
+    the remaining keypoints are then returned.
+
+    Args:
+        keypoints: 2D array containing a keypoint (y, x) in each row
+        response: corner response of each keypoint of shape (K,)
+        cell_size: side length of a grid cell in pixels
+        per_cell: maximum number of keypoints per cell, or None for no limit
+        max_keypoints: maximum number of keypoints overall, or None for no limit
+
+    Returns:
+        selected: the selected keypoints, strongest first
+    """
+    keypoints = np.asarray(keypoints)
+    response = np.asarray(response)
+    order = np.argsort(-response, kind='mergesort')
+
+    if per_cell is not None and len(keypoints):
+        cells = keypoints[order] // cell_size
+        cell_id = cells[:, 0] * (cells[:, 1].max() + 1) + cells[:, 1]
+        # Rank of every keypoint among the ones in its cell, strongest first
+        by_cell = np.argsort(cell_id, kind='mergesort')
+        sorted_ids = cell_id[by_cell]
+        starts = np.r_[0, np.nonzero(np.diff(sorted_ids))[0] + 1]
+        group_start = np.repeat(starts, np.diff(np.r_[starts, len(sorted_ids)]))
+        rank = np.empty(len(order), dtype=np.intp)
+        rank[by_cell] = np.arange(len(order)) - group_start
+        order = order[rank < per_cell]
+
+    if max_keypoints is not None:
+        order = order[:max_keypoints]
+    return keypoints[order]
+
+
+def detect_and_describe(img, desc_func=simple_descriptor, patch_size=5,
+                        window_size=3, k=0.04, threshold_rel=0.05,
+                        cell_size=32, per_cell=None, max_keypoints=None):
+    """
+    Detect Harris keypoints in an image and describe them.
+
+    Args:
+        img: grayscale image of shape (H, W)
+        desc_func: function that takes in an image patch and outputs
+            a 1D feature vector describing the patch
+        patch_size: size of square patch at each keypoint
+        window_size: size of the Harris window function
+        k: Harris sensitivity parameter
+        threshold_rel: minimum corner response relative to the strongest one
+        cell_size: side length of the grid cells used by select_keypoints
+        per_cell: maximum number of keypoints per grid cell, or None
+        max_keypoints: maximum number of keypoints described, or None
+
+    Returns:
+        keypoints: array of shape (K, 2) holding (y, x) keypoints
+        descriptors: array of features describing the keypoints
+    """
+    response = harris_corners(img, window_size=window_size, k=k)
+    keypoints = corner_peaks(response,
+                             threshold_rel=threshold_rel,
+                             exclude_border=8)
+    if per_cell is not None or max_keypoints is not None:
+        keypoints = select_keypoints(keypoints, response[keypoints[:, 0], keypoints[:, 1]],
+                                     cell_size, per_cell, max_keypoints)
+    descriptors = describe_keypoints(img, keypoints,
+                                     desc_func=desc_func,
+                                     patch_size=patch_size)
+    return keypoints, descriptors
+
+
+def _shared_detect_and_describe(shm_name, shape, dtype, params):
+    """Run detect_and_describe on an image held in a shared memory block."""
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        img = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        result = detect_and_describe(img, **params)
+        del img
+    finally:
+        shm.close()
+    return result
+
+
+def extract_and_match(imgs, desc_func=simple_descriptor, patch_size=5,
+                      n_workers=1, use_processes=True, cache=None,
+                      window_size=3, k=0.04, threshold_rel=0.05,
+                      cell_size=32, per_cell=None, max_keypoints=None):
+    """
+    Detect, describe and match keypoints along an ordered chain of images.
+
+    With more than one worker, every image is described on a pool and each
+    pair of neighbours is matched as soon as both of its images are done,
+    so matching overlaps with the remaining feature extraction. Process
+    workers read the images from shared memory instead of receiving pickled
+    copies, where multiprocessing.shared_memory exists (Python >= 3.8).
+
+    Args:
+        imgs: list of length m containing the ordered chain of m images
+        desc_func: function that takes in an image patch and outputs
+            a 1D feature vector describing the patch
+        patch_size: size of square patch at each keypoint
+        n_workers: number of pool workers; 1 runs everything in this process
+        use_processes: use a process pool if True, otherwise a thread pool
+        cache: optional FeatureCache; images with cached features skip
+            detection and description
+        window_size: size of the Harris window function
+        k: Harris sensitivity parameter
+        threshold_rel: minimum corner response relative to the strongest one
+        cell_size: side length of the grid cells used by select_keypoints
+        per_cell: maximum number of keypoints per grid cell, or None
+        max_keypoints: maximum number of keypoints per image, or None
+
+    Returns:
+        keypoints: list of length m; keypoints[i] corresponds to imgs[i]
+        descriptors: list of length m; descriptors[i] corresponds to keypoints[i]
+        matches: list of length m-1; matches[i] corresponds to matches between
+            descriptors[i] and descriptors[i+1]
+    """
+    m = len(imgs)
+    keypoints = [None] * m
+    descriptors = [None] * m
+    matches = [None] * (m - 1)
+    params = dict(desc_func=desc_func, patch_size=patch_size,
+                  window_size=window_size, k=k, threshold_rel=threshold_rel,
+                  cell_size=cell_size, per_cell=per_cell, max_keypoints=max_keypoints)
+    metric = descriptor_metric(desc_func)
+
+    # Load whatever is already cached
+    keys = [None] * m
+    if cache is not None:
+        for i, img in enumerate(imgs):
+            keys[i] = cache.key(img, **params)
+            cached = cache.get(keys[i])
+            if cached is not None:
+                keypoints[i], descriptors[i] = cached
+    missing = [i for i in range(m) if descriptors[i] is None]
+
+    def store(i, result):
+        keypoints[i], descriptors[i] = result
+        if cache is not None:
+            cache.put(keys[i], keypoints[i], descriptors[i])
+
+    if n_workers <= 1:
+        for i in missing:
+            store(i, detect_and_describe(imgs[i], **params))
+        for i in range(m - 1):
+            matches[i] = match_descriptors(descriptors[i], descriptors[i+1], 0.7,
+                                           metric=metric)
+        return keypoints, descriptors, matches
+
+    pool_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    shared_memory = None
+    if use_processes:
+        try:
+            from multiprocessing import shared_memory
+        except ImportError:
+            # Python < 3.8: the workers receive pickled copies of the images
+            pass
+    blocks = []
+    try:
+        with pool_cls(max_workers=n_workers) as pool:
+            match_futures = {}
+
+            def submit_matches(i):
+                for j in (i - 1, i):
+                    if 0 <= j < m - 1 and descriptors[j] is not None \
+                            and descriptors[j+1] is not None and j not in match_futures.values():
+                        match_futures[pool.submit(match_descriptors, descriptors[j],
+                                                  descriptors[j+1], 0.7, metric=metric)] = j
+
+            feature_futures = {}
+            for i in missing:
+                img = imgs[i]
+                if shared_memory is not None:
+                    img = np.ascontiguousarray(img)
+                    shm = shared_memory.SharedMemory(create=True, size=max(img.nbytes, 1))
+                    blocks.append(shm)
+                    np.ndarray(img.shape, dtype=img.dtype, buffer=shm.buf)[...] = img
+                    future = pool.submit(_shared_detect_and_describe, shm.name,
+                                         img.shape, img.dtype, params)
+                else:
+                    future = pool.submit(detect_and_describe, img, **params)
+                feature_futures[future] = i
+
+            # Pairs whose features were all cached can be matched right away
+            for i in range(m):
+                if descriptors[i] is not None:
+                    submit_matches(i)
+
+            # Stream finished images into matching of their neighbour pairs
+            for future in as_completed(feature_futures):
+                i = feature_futures[future]
+                store(i, future.result())
+                submit_matches(i)
+
+            for future in as_completed(match_futures):
+                matches[match_futures[future]] = future.result()
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    return keypoints, descriptors, matches
+
+
+def _local_ncc_search(img1, img2, pts1, pts2, patch_size, radius, chunk_size=128):
+    """
+    For every point in img1, find the best matching position in img2 within
+    `radius` pixels of a predicted location, by normalized cross-correlation.
+
+    Args:
+        img1: grayscale image of shape (H1, W1)
+        img2: grayscale image of shape (H2, W2)
+        pts1: integer (y, x) points in img1 of shape (K, 2)
+        pts2: integer predicted (y, x) points in img2 of shape (K, 2)
+        patch_size: odd size of the square patches compared
+        radius: search radius around each prediction
+        chunk_size: number of points searched at a time
+
+    Returns:
+        best: (y, x) positions in img2 of shape (K, 2)
+        score: NCC score in [-1, 1] of each best position; -inf where the
+            patch or the search window leaves an image
+    """
+    half = patch_size // 2
+    reach = half + radius
+    K = len(pts1)
+    best = np.zeros((K, 2), dtype=np.intp)
+    score = np.full(K, -np.inf)
+
+    valid = ((pts1 >= half).all(axis=1) &
+             (pts1 < np.array(img1.shape) - half).all(axis=1) &
+             (pts2 >= reach).all(axis=1) &
+             (pts2 < np.array(img2.shape) - reach).all(axis=1))
+    idx = np.nonzero(valid)[0]
+    off_t = np.arange(-half, half + 1)
+    off_s = np.arange(-reach, reach + 1)
+
+    def normalize(x, axes):
+        x = x - x.mean(axis=axes, keepdims=True)
+        std = x.std(axis=axes, keepdims=True)
+        return x / np.where(std > 0, std, 1)
+
+    for s in range(0, len(idx), chunk_size):
+        sel = idx[s:s+chunk_size]
+        p1, p2 = pts1[sel], pts2[sel]
+        templ = img1[(p1[:, 0, None] + off_t)[:, :, None],
+                     (p1[:, 1, None] + off_t)[:, None, :]]
+        region = img2[(p2[:, 0, None] + off_s)[:, :, None],
+                      (p2[:, 1, None] + off_s)[:, None, :]]
+        # (n, 2r+1, 2r+1, p, p) candidate patches at every offset, as a view
+        st = region.strides
+        cands = np.lib.stride_tricks.as_strided(
+            region, shape=(len(sel), 2 * radius + 1, 2 * radius + 1, patch_size, patch_size),
+            strides=(st[0], st[1], st[2], st[1], st[2]), writeable=False)
+        ncc = np.einsum('nijab,nab->nij', normalize(cands, (3, 4)),
+                        normalize(templ, (1, 2))) / patch_size ** 2
+        flat = ncc.reshape(len(sel), -1).argmax(axis=1)
+        dy, dx = np.unravel_index(flat, ncc.shape[1:])
+        best[sel] = p2 + np.stack([dy, dx], axis=1) - radius
+        score[sel] = ncc.reshape(len(sel), -1)[np.arange(len(sel)), flat]
+    return best, score
+
+
+def register_coarse_to_fine(img1, img2, desc_func=simple_descriptor, patch_size=5,
+                            downscale=4, search_radius=None, refine_patch_size=11,
+                            ncc_threshold=0.8, threshold=4, seed=None):
+    """
+    Estimate the homography between two images on a downscaled level and
+    refine it at full resolution with a local search.
+
+        1. Detect, describe and match keypoints on both images reduced by
+           `downscale`, and run RANSAC to get a coarse homography
+        2. Scale the homography and the keypoints of img1 to full resolution
+        3. Search for each keypoint only within `search_radius` pixels of
+           its predicted location in img2, by normalized cross-correlation
+           of full-resolution patches
+        4. Run RANSAC on the refined correspondences
+
+    Args:
+        img1: grayscale image of shape (H1, W1)
+        img2: grayscale image of shape (H2, W2)
+        desc_func: function that takes in an image patch and outputs
+            a 1D feature vector describing the patch, used on the coarse level
+        patch_size: size of square patch at each coarse keypoint
+        downscale: factor by which the coarse level is reduced
+        search_radius: full-resolution search radius; defaults to 2 * downscale
+        refine_patch_size: odd size of the patches compared at full resolution
+        ncc_threshold: minimum correlation of a refined correspondence
+        threshold: RANSAC inlier threshold at full resolution
+        seed: seed or np.random.RandomState passed to ransac
+
+    Returns:
+        H: homography mapping (x, y) points in img1 to img2, or None if the
+            registration failed, i.e. fewer than 4 inliers were found on the
+            coarse level or after refinement; callers should then fall back
+            to matching at full resolution
+        keypoints1: refined (y, x) keypoints in img1 of shape (K, 2)
+        keypoints2: corresponding (y, x) keypoints in img2 of shape (K, 2)
+        matches: inlier matches as indices into keypoints1 and keypoints2;
+            empty if the registration failed
+    """
+    rng = _random_state(seed)
+
+    # Coarse registration
+    if downscale > 1:
+        small1 = pyramid_reduce(img1, downscale)
+        small2 = pyramid_reduce(img2, downscale)
+    else:
+        small1, small2 = img1, img2
+    kp1, desc1 = detect_and_describe(small1, desc_func, patch_size)
+    kp2, desc2 = detect_and_describe(small2, desc_func, patch_size)
+    matches = match_descriptors(desc1, desc2, 0.7, metric=descriptor_metric(desc_func))
+    return _refine_registration(img1, img2, kp1, kp2, matches,
+                                downscale, search_radius, refine_patch_size, ncc_threshold,
+                                threshold, rng)
+
+
+def _refine_registration(img1, img2, kp1, kp2, matches, downscale, search_radius,
+                         refine_patch_size, ncc_threshold, threshold, rng):
+    """
+    Steps 1 (RANSAC) to 4 of register_coarse_to_fine, given keypoints and
+    matches found on images reduced by `downscale`.
+    """
+    if search_radius is None:
+        search_radius = 2 * downscale
+    empty = np.zeros((0, 2), dtype=np.intp)
+
+    H_small, coarse_inliers = ransac(kp1, kp2, matches, seed=rng)
+    if len(coarse_inliers) < 4:
+        return None, empty, empty, empty
+
+    # A coarse pixel i covers full-resolution pixels [i*s, (i+1)*s)
+    c = (downscale - 1) / 2
+    S = np.array([[downscale, 0, c], [0, downscale, c], [0, 0, 1]], dtype=np.float64)
+    H = S.dot(H_small).dot(np.linalg.inv(S))
+
+    # Local search at full resolution around the predicted correspondences
+    pts1 = np.round(kp1 * downscale + c).astype(np.intp)
+    pred = transform_homography(pts1[:, ::-1].astype(np.float64), H)[:, ::-1]
+    pts2 = np.round(pred).astype(np.intp)
+    best, score = _local_ncc_search(img1, img2, pts1, pts2,
+                                    refine_patch_size, search_radius)
+    keep = score > ncc_threshold
+    keypoints1, keypoints2 = pts1[keep], best[keep]
+
+    n = len(keypoints1)
+    if n < 4:
+        return None, keypoints1, keypoints2, empty
+    H, matches = ransac(keypoints1, keypoints2, np.stack([np.arange(n)] * 2, axis=1),
+                        threshold=threshold, seed=rng)
+    if len(matches) < 4:
+        return None, keypoints1, keypoints2, empty
+    return H, keypoints1, keypoints2, matches
+
+
+def guided_match(keypoints1, desc1, keypoints2, desc2, h_matrix, radius=20, threshold=0.7,
+                 max_candidates=16, metric='euclidean'):
+    """
+    Match descriptors only against keypoints near their predicted location.
+
+    Every keypoint of the first image is mapped by `h_matrix`, and only the
+    keypoints of the second image within `radius` pixels of the prediction
+    are considered. The ratio test of match_descriptors is applied among those
+    candidates; a lone candidate has no second-closest descriptor and is
+    accepted.
+
+    Args:
+        keypoints1: (y, x) keypoints of the first image of shape (M, 2)
+        desc1: descriptors of keypoints1 of shape (M, P)
+        keypoints2: (y, x) keypoints of the second image of shape (N, 2)
+        desc2: descriptors of keypoints2 of shape (N, P)
+        h_matrix: predicted homography mapping (x, y) points of image 1 to image 2
+        radius: search radius around each prediction in pixels
+        threshold: maximum ratio of closest to second-closest distance
+        max_candidates: maximum number of candidates per keypoint
+        metric: 'euclidean', or 'hamming' for packed binary uint8 descriptors
+
+    Returns:
+        matches: an array of shape (Q, 2) where each row holds the indices of one pair
+        of matching descriptors
+    """
+    M, N = len(keypoints1), len(keypoints2)
+    if M == 0 or N == 0:
+        return np.zeros((0, 2), dtype=np.intp)
+
+    pred = transform_homography(np.asarray(keypoints1, dtype=np.float64)[:, ::-1], h_matrix)
+    tree = cKDTree(np.asarray(keypoints2, dtype=np.float64)[:, ::-1])
+    k = min(max_candidates, N)
+    _, cand = tree.query(pred, k=k, distance_upper_bound=radius)
+    cand = np.asarray(cand).reshape(M, k)
+    found = cand < N
+
+    # Descriptor distances to the candidates only; missing candidates are inf
+    desc1 = np.asarray(desc1)
+    desc2 = np.asarray(desc2)
+    safe = np.where(found, cand, 0)
+    if metric == 'hamming':
+        diff = np.unpackbits(desc2[safe] ^ desc1[:, None, :], axis=2)
+        dists = diff.sum(axis=2).astype(np.float64)
+    else:
+        dists = np.linalg.norm(desc2[safe].astype(np.float64) - desc1[:, None, :], axis=2)
+    dists[~found] = np.inf
+
+    order = np.argsort(dists, axis=1)[:, :2]
+    rows = np.arange(M)
+    best = dists[rows, order[:, 0]]
+    second = dists[rows, order[:, 1]] if k > 1 else np.full(M, np.inf)
+    keep = np.isfinite(best) & (best < threshold * second)
+    return np.stack([rows[keep], safe[keep, order[keep, 0]]], axis=1)
+
+
+def refine_homography(src, dst, h_matrix, n_iters=5, damping=1e-3):
+    """
+    Refine a homography by Levenberg-Marquardt on the reprojection error.
+
+    Minimizes the sum of squared distances between dst and src mapped by the
+    homography, over its 8 free entries with H[2, 2] fixed to 1.
+
+    Args:
+        src: (x, y) points of shape (N, 2)
+        dst: corresponding (x, y) points of shape (N, 2)
+        h_matrix: initial homography mapping src to dst
+        n_iters: number of iterations
+        damping: initial Levenberg-Marquardt damping factor
+
+    Returns:
+        h_matrix: refined homography
+    """
+    src = np.asarray(src, dtype=np.float64)
+    dst = np.asarray(dst, dtype=np.float64)
+    h = (h_matrix / h_matrix[2, 2]).ravel()[:8].copy()
+    x, y = src[:, 0], src[:, 1]
+    ones, zeros = np.ones_like(x), np.zeros_like(x)
+    src_h = to_homogeneous(src)
+
+    def residuals(h):
+        H = np.append(h, 1).reshape(3, 3)
+        return (transform_points(src_h, H) - dst).ravel()
+
+    r = residuals(h)
+    cost = r.dot(r)
+    for _ in range(n_iters):
+        H = np.append(h, 1).reshape(3, 3)
+        w = H[2, 0] * x + H[2, 1] * y + 1
+        u = (H[0, 0] * x + H[0, 1] * y + H[0, 2]) / w
+        v = (H[1, 0] * x + H[1, 1] * y + H[1, 2]) / w
+        J = np.empty((len(x), 2, 8))
+        J[:, 0] = np.stack([x, y, ones, zeros, zeros, zeros, -u * x, -u * y], axis=1) / w[:, None]
+        J[:, 1] = np.stack([zeros, zeros, zeros, x, y, ones, -v * x, -v * y], axis=1) / w[:, None]
+        J = J.reshape(-1, 8)
+
+        JtJ = J.T.dot(J)
+        step = np.linalg.solve(JtJ + damping * np.diag(np.diag(JtJ)), -J.T.dot(r))
+        r_new = residuals(h + step)
+        cost_new = r_new.dot(r_new)
+        if cost_new < cost:
+            h, r, cost = h + step, r_new, cost_new
+            damping /= 10
+        else:
+            damping *= 10
+    return np.append(h, 1).reshape(3, 3)
+
+
+def track_homographies(frames, desc_func=simple_descriptor, patch_size=5, radius=20,
+                       threshold=20, min_inlier_ratio=0.5, min_inliers=8, n_refine=5,
+                       seed=None):
+    """
+    Estimate the homographies between consecutive video frames.
+
+    The homography of each pair is predicted from the previous pair's.
+    Descriptors are matched only within `radius` pixels of their predicted
+    positions, and the prediction is refined by Levenberg-Marquardt on the
+    inliers. Full matching and RANSAC run only for the first pair, and
+    whenever the inlier ratio of the guided matches drops below
+    `min_inlier_ratio` or too few inliers remain.
+
+    Args:
+        frames: list of grayscale frames
+        desc_func: function that takes in an image patch and outputs
+            a 1D feature vector describing the patch
+        patch_size: size of square patch at each keypoint
+        radius: search radius of guided matching in pixels
+        threshold: squared reprojection distance below which a match is an inlier
+        min_inlier_ratio: inlier ratio below which full RANSAC is run
+        min_inliers: number of inliers below which full RANSAC is run
+        n_refine: number of Levenberg-Marquardt iterations per pair
+        seed: seed or np.random.RandomState passed to ransac
+
+    Returns:
+        h_matrices: list of length len(frames)-1; h_matrices[i] maps (x, y)
+            points in frames[i] to frames[i+1]
+        used_ransac: list of booleans telling which pairs fell back to RANSAC
+    """
+    h_matrices = []
+    used_ransac = []
+    rng = _random_state(seed)
+    metric = descriptor_metric(desc_func)
+    prev_kp, prev_desc = detect_and_describe(frames[0], desc_func, patch_size)
+
+    for frame in frames[1:]:
+        kp, desc = detect_and_describe(frame, desc_func, patch_size)
+        H = None
+        if h_matrices:
+            H_pred = h_matrices[-1]
+            matches = guided_match(prev_kp, prev_desc, kp, desc, H_pred, radius,
+                                   metric=metric)
+            if len(matches):
+                src = prev_kp[matches[:, 0]][:, ::-1].astype(np.float64)
+                dst = kp[matches[:, 1]][:, ::-1].astype(np.float64)
+                err = np.sum(np.square(transform_homography(src, H_pred) - dst), axis=1)
+                inliers = err < threshold
+                if inliers.sum() >= min_inliers and inliers.mean() >= min_inlier_ratio:
+                    H = refine_homography(src[inliers], dst[inliers], H_pred, n_refine)
+        used_ransac.append(H is None)
+        if H is None:
+            matches = match_descriptors(prev_desc, desc, 0.7, metric=metric)
+            H, _ = ransac(prev_kp, kp, matches, threshold=threshold, seed=rng)
+        h_matrices.append(H)
+        prev_kp, prev_desc = kp, desc
+
+    return h_matrices, used_ransac
+
+
+def stitch_multiple_images(imgs, desc_func=simple_descriptor, patch_size=5,
+                           n_workers=1, use_processes=True, cache=None,
+                           downscale=None, per_cell=None, max_keypoints=None, seed=None,
+                           blend='feather'):
     """
     Stitch an ordered chain of images together.
 
@@ -515,33 +1859,64 @@ def stitch_multiple_images(imgs, desc_func=simple_descriptor, patch_size=5):
         desc_func: Function that takes in an image patch and outputs
             a 1D feature vector describing the patch
         patch_size: Size of square patch at each keypoint
+        n_workers: Number of workers used for feature extraction and matching
+        use_processes: Use worker processes if True, otherwise threads
+        cache: Optional FeatureCache reused across runs on the same images
+        downscale: If given, register each pair coarse-to-fine as in
+            register_coarse_to_fine, on images reduced by this factor; pairs
+            where that fails are matched at full resolution instead
+        per_cell: Maximum number of keypoints kept per 32x32 grid cell
+        max_keypoints: Maximum number of keypoints described per image
+        seed: Seed or np.random.RandomState passed to ransac; the global numpy
+            random state is used if None
+        blend: Blending of the warped images, 'feather', 'linear' or
+            'multiband'; see compose_panorama
 
     Returns:
         panorama: Final panorma image in coordinate frame of reference image
-    """
-    # Detect keypoints in each image
-    keypoints = []  # keypoints[i] corresponds to imgs[i]
-    for img in imgs:
-        kypnts = corner_peaks(harris_corners(img, window_size=3),
-                              threshold_rel=0.05,
-                              exclude_border=8)
-        keypoints.append(kypnts)
-    # Describe keypoints
-    descriptors = []  # descriptors[i] corresponds to keypoints[i]
-    for i, kypnts in enumerate(keypoints):
-        desc = describe_keypoints(imgs[i], kypnts,
-                                  desc_func=desc_func,
-                                  patch_size=patch_size)
-        descriptors.append(desc)
-    # Match keypoints in neighboring images
-    matches = []  # matches[i] corresponds to matches between
-                  # descriptors[i] and descriptors[i+1]
-    for i in range(len(imgs)-1):
-        mtchs = match_descriptors(descriptors[i], descriptors[i+1], 0.7)
-        matches.append(mtchs)
 
+    Raises:
+        ValueError: if no homography can be estimated between two neighbours
+    """
     ### YOUR CODE HERE
-    raise NotImplementedError() # Delete this line
+    rng = _random_state(seed)
+    params = dict(n_workers=n_workers, use_processes=use_processes, cache=cache,
+                  per_cell=per_cell, max_keypoints=max_keypoints)
+    h_matrices = [None] * (len(imgs) - 1)
+    if downscale is not None:
+        # Estimate each pairwise homography coarse-to-fine
+        small = [pyramid_reduce(img, downscale) if downscale > 1 else img for img in imgs]
+        keypoints, _, matches = extract_and_match(small, desc_func, patch_size, **params)
+        for i, mtchs in enumerate(matches):
+            h_matrices[i] = _refine_registration(imgs[i], imgs[i+1], keypoints[i],
+                                                 keypoints[i+1], mtchs, downscale,
+                                                 search_radius=None, refine_patch_size=11,
+                                                 ncc_threshold=0.8, threshold=4, rng=rng)[0]
+
+    # Detect and describe keypoints in each image, and match keypoints in
+    # neighboring images, over every run of pairs not registered coarse-to-fine
+    i = 0
+    while i < len(h_matrices):
+        if h_matrices[i] is not None:
+            i += 1
+            continue
+        j = i
+        while j + 1 < len(h_matrices) and h_matrices[j+1] is None:
+            j += 1
+        keypoints, _, matches = extract_and_match(imgs[i:j+2], desc_func, patch_size, **params)
+
+        # Robustly estimate the homography between each pair of neighbours
+        for k, mtchs in enumerate(matches):
+            h_matrices[i+k], inliers = ransac(keypoints[k], keypoints[k+1], mtchs, seed=rng)
+            if len(inliers) == 0:
+                raise ValueError('could not estimate the homography between images %d and %d'
+                                 % (i + k, i + k + 1))
+        i = j + 1
+
+    # Bring every image into the frame of the middle image
+    ref = len(imgs) // 2
+    transforms = chain_homographies(h_matrices, ref)
+    panorama = compose_panorama(imgs, transforms, ref, blend=blend)
     ### END YOUR CODE
 
     return panorama
@@ -1,8 +1,10 @@
 import numpy as np
 from scipy.ndimage import affine_transform
 
+from geometry import to_homogeneous
+
 # Functions to convert points to homogeneous coordinates and back
-pad = lambda x: np.hstack([x, np.ones((x.shape[0], 1))])
+pad = to_homogeneous
 unpad = lambda x: x[:,:-1]
 
 def plot_matches(ax, image1, image2, keypoints1, keypoints2, matches,
@@ -86,28 +88,36 @@ def plot_matches(ax, image1, image2, keypoints1, keypoints2, matches,
 '-', color=color)
 
 
-def get_output_space(img_ref, imgs, transforms):
+def get_output_space(img_ref, imgs, transforms, projective=False):
     """
     Args:
         img_ref: reference image
         imgs: images to be transformed
         transforms: list of affine transformation matrices. transforms[i] maps
             points in imgs[i] to the points in img_ref
+        projective: if True, transforms are full 3x3 homographies acting on
+            column vectors (x, y, 1), as returned by compute_homography, and
+            corners are warped with the perspective division
     Returns:
         output_shape
     """
 
     assert (len(imgs) == len(transforms))
 
-    r, c = img_ref.shape
+    r, c = img_ref.shape[:2]
     corners = np.array([[0, 0], [r, 0], [0, c], [r, c]])
     all_corners = [corners]
 
     for i in range(len(imgs)):
-        r, c = imgs[i].shape
+        r, c = imgs[i].shape[:2]
         H = transforms[i]
         corners = np.array([[0, 0], [r, 0], [0, c], [r, c]])
-        warped_corners = corners.dot(H[:2,:2]) + H[2,:2]
+        if projective:
+            # (r, c) -> (x, y, 1) -> warped (x, y) -> (r, c)
+            warped = pad(corners[:, ::-1].astype(np.float64)).dot(H.T)
+            warped_corners = (warped[:, :2] / warped[:, 2:])[:, ::-1]
+        else:
+            warped_corners = corners.dot(H[:2,:2]) + H[2,:2]
         all_corners.append(warped_corners)
 
     # Find the extents of both the reference image and the warped
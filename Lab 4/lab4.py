@@ -5,19 +5,66 @@ import cv2
 import numpy as np
 import random
 
+from collections import OrderedDict
 from time import time
 
 
 # Part 1 
 
-def meanShift(dst, track_window, max_iter=100,stop_thresh=1):
+def integral_moments(dst, second_order=False):
+    """Build summed-area tables of the image moments of a back projection.
+
+    Args:
+        dst (np.ndarray)            : Back projection of the object histogram of shape (H, W).
+        second_order (bool)         : Also build tables for x*x*dst, y*y*dst and x*y*dst.
+
+    Returns:
+        tables (np.ndarray)         : Array of shape (K, H+1, W+1) where K is 3, or 6 with
+                                      second_order. tables[k][i, j] is the sum of the k-th
+                                      moment image over dst[:i, :j]. The moment images are, in
+                                      order, dst, x*dst, y*dst[, x*x*dst, y*y*dst, x*y*dst].
+    """
+    H, W = dst.shape
+    dst = dst.astype(np.float64)
+    ys, xs = np.mgrid[0:H, 0:W]
+    moments = [dst, xs * dst, ys * dst]
+    if second_order:
+        moments += [xs * xs * dst, ys * ys * dst, xs * ys * dst]
+
+    tables = np.zeros((len(moments), H + 1, W + 1))
+    for table, moment in zip(tables, moments):
+        np.cumsum(np.cumsum(moment, axis=0), axis=1, out=table[1:, 1:])
+    return tables
+
+
+def window_moments(tables, x0, y0, x1, y1):
+    """Sum every moment image over the windows [y0:y1, x0:x1] in O(1) per window.
+
+    Args:
+        tables (np.ndarray)         : Summed-area tables from integral_moments, shape (K, H+1, W+1).
+        x0, y0, x1, y1              : Window bounds, clipped to the image. Scalars or arrays of
+                                      the same shape for many windows at once.
+
+    Returns:
+        sums (np.ndarray)           : Moment sums of shape (K,) + shape of the bounds.
+    """
+    return tables[:, y1, x1] - tables[:, y0, x1] - tables[:, y1, x0] + tables[:, y0, x0]
+
+
+def meanShift(dst, track_window, max_iter=100,stop_thresh=1, tables=None):
     """Use mean shift algorithm to find an object on a back projection image.
 
+    The window moments are read from summed-area tables of dst, so every
+    iteration costs O(1) regardless of the window size.
+
     Args:
         dst (np.ndarray)            : Back projection of the object histogram of shape (H, W).
         track_window (tuple)        : Initial search window. (x,y,w,h)
         max_iter (int)              : Max iteration for mean shift.
         stop_thresh(float)          : Threshold for convergence.
+        tables (np.ndarray)         : Summed-area tables of dst from integral_moments. Built
+                                      here if not given; pass them to share them between
+                                      several windows on the same frame.
     
     Returns:
         track_window (tuple)        : Final tracking result. (x,y,w,h)
@@ -30,20 +77,22 @@ def meanShift(dst, track_window, max_iter=100,stop_thresh=1):
     """ YOUR CODE STARTS HERE """
     H, W = dst.shape
     _, _, w, h = track_window
-    wind_coords = np.array([[[x, y] for x in range(w)] for y in range(h)])
+    if tables is None:
+        tables = integral_moments(dst)
 
     while completed_iterations < max_iter:
         x, y, _, _ = track_window
         s_h, e_h, s_w, e_w = max(0, y), min(y+h, H), max(0, x), min(x+w, W)
-        
-        roi = dst[s_h:e_h, s_w:e_w]
-        curr_window = wind_coords[s_h-y:e_h-y, s_w-x:e_w-x]
+        if s_h >= e_h or s_w >= e_w:
+            break
+
+        total_weights, sum_x, sum_y = window_moments(tables[:3], s_w, s_h, e_w, e_h)
+        if total_weights <= 0:
+            break
         curr_wind_mean = np.array([e_w-s_w, e_h-s_h]) / 2
-        
-        total_weights = np.sum(roi)
-        sample_mean_x = np.sum(roi * curr_window[:,:,0]) 
-        sample_mean_y = np.sum(roi * curr_window[:,:,1])
-        sample_mean = np.array([sample_mean_x, sample_mean_y]) / total_weights
+
+        # Centroid relative to the window origin
+        sample_mean = np.array([sum_x / total_weights - x, sum_y / total_weights - y])
         
         shift = sample_mean - curr_wind_mean
         if np.sum(np.square(shift)) < stop_thresh:
@@ -57,6 +106,251 @@ def meanShift(dst, track_window, max_iter=100,stop_thresh=1):
     return track_window
        
 
+def meanShiftMulti(dst, track_windows, max_iter=100, stop_thresh=1, tables=None):
+    """Run mean shift for many windows on the same back projection at once.
+
+    All windows that have not converged yet are moved together in every
+    iteration, with their moments looked up from one set of summed-area tables.
+    Each window follows the same update as meanShift.
+
+    Args:
+        dst (np.ndarray)            : Back projection of the object histogram of shape (H, W).
+        track_windows (np.ndarray)  : Initial search windows of shape (M, 4). Each row is (x,y,w,h).
+        max_iter (int)              : Max iteration for mean shift.
+        stop_thresh(float)          : Threshold for convergence.
+        tables (np.ndarray)         : Summed-area tables of dst from integral_moments. Built
+                                      here if not given.
+
+    Returns:
+        track_windows (np.ndarray)  : Final tracking results of shape (M, 4).
+        iterations (np.ndarray)     : Number of iterations run for each window, shape (M,).
+        converged (np.ndarray)      : Whether each window converged before max_iter, shape (M,).
+                                      Windows that leave the image or see no weight stop
+                                      without converging.
+    """
+    H, W = dst.shape
+    if tables is None:
+        tables = integral_moments(dst)
+
+    windows = np.array(track_windows, dtype=np.int64).reshape(-1, 4)
+    M = len(windows)
+    iterations = np.zeros(M, dtype=np.int64)
+    converged = np.zeros(M, dtype=bool)
+    active = np.ones(M, dtype=bool)
+
+    while np.any(active):
+        idx = np.nonzero(active & (iterations < max_iter))[0]
+        active[:] = False
+        if len(idx) == 0:
+            break
+        x, y, w, h = windows[idx].T
+        s_h, e_h = np.maximum(0, y), np.minimum(y + h, H)
+        s_w, e_w = np.maximum(0, x), np.minimum(x + w, W)
+        valid = (s_h < e_h) & (s_w < e_w)
+        s_h, e_h = np.where(valid, s_h, 0), np.where(valid, e_h, 0)
+        s_w, e_w = np.where(valid, s_w, 0), np.where(valid, e_w, 0)
+
+        total_weights, sum_x, sum_y = window_moments(tables[:3], s_w, s_h, e_w, e_h)
+        valid &= total_weights > 0
+        total_weights = np.where(valid, total_weights, 1)
+
+        # Centroid relative to the window origin, minus the window centre
+        shift_x = sum_x / total_weights - x - (e_w - s_w) / 2
+        shift_y = sum_y / total_weights - y - (e_h - s_h) / 2
+        done = shift_x ** 2 + shift_y ** 2 < stop_thresh
+        converged[idx[valid & done]] = True
+
+        keep = valid & ~done
+        move = idx[keep]
+        windows[move, 0] = np.trunc(x[keep] + shift_x[keep]).astype(np.int64)
+        windows[move, 1] = np.trunc(y[keep] + shift_y[keep]).astype(np.int64)
+        iterations[move] += 1
+        active[move] = True
+
+    return windows, iterations, converged
+
+
+def camShift(dst, track_window, max_iter=100, stop_thresh=1, tables=None):
+    """Continuously adaptive mean shift: track an object that changes size and orientation.
+
+    The window is first moved with meanShift. Its size and orientation are then
+    updated from the zeroth and second-order moments of dst inside the converged
+    window, so the window follows the object rather than staying at its initial size.
+
+    Args:
+        dst (np.ndarray)            : Back projection of the object histogram of shape (H, W).
+        track_window (tuple)        : Initial search window. (x,y,w,h)
+        max_iter (int)              : Max iteration for mean shift.
+        stop_thresh(float)          : Threshold for convergence.
+        tables (np.ndarray)         : Second-order summed-area tables of dst from
+                                      integral_moments(dst, second_order=True). Built here if
+                                      not given.
+
+    Returns:
+        rotated_box (tuple)         : Oriented object box ((cx, cy), (length, width), angle)
+                                      with the angle in degrees, as used by cv2.boxPoints.
+        track_window (tuple)        : Search window for the next frame. (x,y,w,h)
+    """
+    H, W = dst.shape
+    if tables is None:
+        tables = integral_moments(dst, second_order=True)
+
+    x, y, w, h = meanShift(dst, track_window, max_iter, stop_thresh, tables=tables)
+    s_h, e_h, s_w, e_w = max(0, y), min(y+h, H), max(0, x), min(x+w, W)
+    if s_h >= e_h or s_w >= e_w:
+        return ((x + w / 2, y + h / 2), (0, 0), 0), (x, y, w, h)
+
+    m00, m10, m01, m20, m02, m11 = window_moments(tables, s_w, s_h, e_w, e_h)
+    if m00 <= 0:
+        return ((x + w / 2, y + h / 2), (0, 0), 0), (x, y, w, h)
+
+    # Centroid and normalized central second moments
+    cx, cy = m10 / m00, m01 / m00
+    a = m20 / m00 - cx * cx
+    b = m11 / m00 - cx * cy
+    c = m02 / m00 - cy * cy
+
+    # Orientation of the major axis and the spread along both axes
+    square = np.sqrt(4 * b * b + (a - c) ** 2)
+    theta = np.arctan2(2 * b, a - c + square)
+    cs, sn = np.cos(theta), np.sin(theta)
+    var_major = max(cs * cs * a + 2 * cs * sn * b + sn * sn * c, 0)
+    var_minor = max(sn * sn * a - 2 * cs * sn * b + cs * cs * c, 0)
+    length, width = 4 * np.sqrt(var_major), 4 * np.sqrt(var_minor)
+    rotated_box = ((cx, cy), (length, width), np.degrees(theta))
+
+    # Next search window: axis-aligned bounds of the oriented box
+    half_w = (abs(cs) * length + abs(sn) * width) / 2
+    half_h = (abs(sn) * length + abs(cs) * width) / 2
+    x0 = int(np.clip(np.floor(cx - half_w), 0, W - 1))
+    y0 = int(np.clip(np.floor(cy - half_h), 0, H - 1))
+    x1 = int(np.clip(np.ceil(cx + half_w), x0 + 1, W))
+    y1 = int(np.clip(np.ceil(cy + half_h), y0 + 1, H))
+    return rotated_box, (x0, y0, x1 - x0, y1 - y0)
+
+
+def _quantize_colors(frame, bins=16, color_space='hue'):
+    """Map every pixel of an RGB frame to a histogram bin.
+
+    Args:
+        frame (np.ndarray)          : RGB image of shape (H, W, 3) and dtype uint8.
+        bins (int)                  : Number of bins per channel.
+        color_space (str)           : 'hue' for a 1D hue histogram, or 'lab' for a 2D histogram
+                                      over the a and b channels of CIE Lab.
+
+    Returns:
+        indices (np.ndarray)        : Bin index of every pixel, shape (H, W).
+        valid (np.ndarray)          : Pixels that take part in the histogram, shape (H, W). For
+                                      hue, dark and unsaturated pixels are left out because
+                                      their hue is unreliable.
+    """
+    if color_space == 'hue':
+        hsv = cv2.cvtColor(frame, cv2.COLOR_RGB2HSV)
+        indices = hsv[..., 0].astype(np.intp) * bins // 180
+        valid = (hsv[..., 1] >= 60) & (hsv[..., 2] >= 32)
+    elif color_space == 'lab':
+        lab = cv2.cvtColor(frame, cv2.COLOR_RGB2LAB)
+        indices = (lab[..., 1].astype(np.intp) * bins // 256) * bins + \
+            lab[..., 2].astype(np.intp) * bins // 256
+        valid = np.ones(indices.shape, dtype=bool)
+    else:
+        raise ValueError("color_space must be 'hue' or 'lab'")
+    return indices, valid
+
+
+def histogram_model(frame, bbox, bins=16, color_space='hue'):
+    """Build the colour histogram of the object inside a bounding box.
+
+    Args:
+        frame (np.ndarray)          : RGB image of shape (H, W, 3) and dtype uint8.
+        bbox (tuple)                : Object bounding box (x, y, w, h), e.g. from load_bboxes.
+        bins (int)                  : Number of bins per channel.
+        color_space (str)           : 'hue' or 'lab', see _quantize_colors.
+
+    Returns:
+        hist (np.ndarray)           : Histogram scaled to a maximum of 255. It is used directly
+                                      as the lookup table of back_project.
+    """
+    x, y, w, h = bbox
+    H, W = frame.shape[:2]
+    roi = frame[max(y, 0):min(y+h, H), max(x, 0):min(x+w, W)]
+    indices, valid = _quantize_colors(roi, bins, color_space)
+    n_bins = bins if color_space == 'hue' else bins * bins
+    hist = np.bincount(indices[valid], minlength=n_bins).astype(np.float64)
+    if hist.max() > 0:
+        hist *= 255 / hist.max()
+    return hist
+
+
+def back_project(frame, hist, bins=16, color_space='hue', region=None):
+    """Compute the back projection of a histogram model on a frame.
+
+    Args:
+        frame (np.ndarray)          : RGB image of shape (H, W, 3) and dtype uint8.
+        hist (np.ndarray)           : Histogram model from histogram_model.
+        bins (int)                  : Number of bins per channel of the model.
+        color_space (str)           : Colour space of the model.
+        region (tuple)              : Optional (x0, y0, x1, y1); only frame[y0:y1, x0:x1] is
+                                      back projected.
+
+    Returns:
+        dst (np.ndarray)            : Back projection of shape (y1-y0, x1-x0), or of the whole
+                                      frame if no region is given.
+    """
+    if region is not None:
+        x0, y0, x1, y1 = region
+        frame = frame[y0:y1, x0:x1]
+    indices, valid = _quantize_colors(frame, bins, color_space)
+    dst = hist[indices]
+    dst[~valid] = 0
+    return dst
+
+
+def track_back_projection(frames, bbox, bins=16, color_space='hue', margin=0.5,
+                          update_rate=0.0, max_iter=100, stop_thresh=1):
+    """Track an object with meanShift on histogram back projections.
+
+    The histogram model is built from the first frame. In every following frame,
+    only a search region around the current window is back projected: the window
+    grown by `margin` times its size on each side.
+
+    Args:
+        frames (list)               : RGB frames of dtype uint8, e.g. from load_frames_rgb.
+        bbox (tuple)                : Object bounding box (x, y, w, h) in frames[0].
+        bins (int)                  : Number of bins per channel of the model.
+        color_space (str)           : 'hue' or 'lab'.
+        margin (float)              : Size of the search region around the window.
+        update_rate (float)         : If positive, the model is blended with the histogram of
+                                      the tracked window after every frame at this rate.
+        max_iter (int)              : Max iteration for mean shift.
+        stop_thresh(float)          : Threshold for convergence.
+
+    Returns:
+        bboxes (list)               : Tracked window (x, y, w, h) in every frame.
+    """
+    hist = histogram_model(frames[0], bbox, bins, color_space)
+    track_window = tuple(int(v) for v in bbox)
+    bboxes = [track_window]
+
+    for frame in frames[1:]:
+        H, W = frame.shape[:2]
+        x, y, w, h = track_window
+        mx, my = int(np.ceil(margin * w)), int(np.ceil(margin * h))
+        x0, y0 = max(x - mx, 0), max(y - my, 0)
+        x1, y1 = min(x + w + mx, W), min(y + h + my, H)
+        if x0 < x1 and y0 < y1:
+            dst = back_project(frame, hist, bins, color_space, region=(x0, y0, x1, y1))
+            xr, yr, _, _ = meanShift(dst, (x - x0, y - y0, w, h), max_iter, stop_thresh)
+            track_window = (xr + x0, yr + y0, w, h)
+        bboxes.append(track_window)
+
+        if update_rate > 0:
+            current = histogram_model(frame, track_window, bins, color_space)
+            hist = (1 - update_rate) * hist + update_rate * current
+
+    return bboxes
+
+
 def IoU(bbox1, bbox2):
     """ Compute IoU of two bounding boxes.
 
@@ -74,22 +368,145 @@ def IoU(bbox1, bbox2):
 
     """ YOUR CODE STARTS HERE """
 
-    bb_h = min(y1+h1-y2, y2+h2-y1)
-    bb_w = min(x1+w1-x2, x2+w2-x1)
+    # Overlap along each axis, zero when the boxes are apart
+    bb_h = max(0, min(y1+h1, y2+h2) - max(y1, y2))
+    bb_w = max(0, min(x1+w1, x2+w2) - max(x1, x2))
     size1 = h1 * w1
     size2 = h2 * w2
     
     intersection = bb_h * bb_w
     union = size1 + size2 - intersection
-    score = intersection / union
+    score = intersection / union if union > 0 else 0
 
     """ YOUR CODE ENDS HERE """
 
     return score
 
 
+def batch_IoU(bboxes1, bboxes2):
+    """ Compute the IoU of corresponding rows of two arrays of bounding boxes.
+
+    Args:
+        bboxes1 (np.ndarray)        : Bounding boxes (x, y, w, h) of shape (N, 4).
+        bboxes2 (np.ndarray)        : Bounding boxes (x, y, w, h) of shape (N, 4).
+    Returns:
+        scores (np.ndarray)         : IoU scores of shape (N,).
+    """
+    b1 = np.asarray(bboxes1, dtype=np.float64).reshape(-1, 4)
+    b2 = np.asarray(bboxes2, dtype=np.float64).reshape(-1, 4)
+    lo = np.maximum(b1[:, :2], b2[:, :2])
+    hi = np.minimum(b1[:, :2] + b1[:, 2:], b2[:, :2] + b2[:, 2:])
+    intersection = np.prod(np.clip(hi - lo, 0, None), axis=1)
+    union = np.prod(b1[:, 2:], axis=1) + np.prod(b2[:, 2:], axis=1) - intersection
+    return np.divide(intersection, union, out=np.zeros_like(union), where=union > 0)
+
+
+def center_errors(bboxes1, bboxes2):
+    """ Compute the distance between the centres of corresponding bounding boxes.
+
+    Args:
+        bboxes1 (np.ndarray)        : Bounding boxes (x, y, w, h) of shape (N, 4).
+        bboxes2 (np.ndarray)        : Bounding boxes (x, y, w, h) of shape (N, 4).
+    Returns:
+        errors (np.ndarray)         : Centre distances in pixels of shape (N,).
+    """
+    b1 = np.asarray(bboxes1, dtype=np.float64).reshape(-1, 4)
+    b2 = np.asarray(bboxes2, dtype=np.float64).reshape(-1, 4)
+    c1 = b1[:, :2] + b1[:, 2:] / 2
+    c2 = b2[:, :2] + b2[:, 2:] / 2
+    return np.linalg.norm(c1 - c2, axis=1)
+
+
+def success_curve(ious, thresholds=np.linspace(0, 1, 21)):
+    """ Fraction of frames whose IoU exceeds each overlap threshold.
+
+    Args:
+        ious (np.ndarray)           : IoU score of every frame, shape (N,).
+        thresholds (np.ndarray)     : Overlap thresholds, shape (T,).
+    Returns:
+        success (np.ndarray)        : Success rate at every threshold, shape (T,).
+        auc (float)                 : Area under the success curve, i.e. its mean.
+    """
+    success = (np.asarray(ious)[None, :] > np.asarray(thresholds)[:, None]).mean(axis=1)
+    return success, float(success.mean())
+
+
+def precision_curve(errors, thresholds=np.arange(51)):
+    """ Fraction of frames whose centre error is within each distance threshold.
+
+    Args:
+        errors (np.ndarray)         : Centre error of every frame in pixels, shape (N,).
+        thresholds (np.ndarray)     : Distance thresholds in pixels, shape (T,).
+    Returns:
+        precision (np.ndarray)      : Precision at every threshold, shape (T,). The value at
+                                      20 pixels is the usual single-number summary.
+    """
+    return (np.asarray(errors)[None, :] <= np.asarray(thresholds)[:, None]).mean(axis=1)
+
+
+def load_groundtruths(root='.', sequences=('Man', 'BlurBody', 'TeaCan')):
+    """ Load the ground truth boxes of several sequences.
+
+    Args:
+        root (str)                  : Directory holding the sequence directories.
+        sequences (tuple)           : Names of the sequences.
+    Returns:
+        groundtruths (dict)         : Sequence name to array of boxes (x, y, w, h) of shape (N, 4).
+                                      Sequences without a groundtruth_rect.txt are left out.
+    """
+    groundtruths = {}
+    for name in sequences:
+        gt_path = os.path.join(root, name, 'groundtruth_rect.txt')
+        if os.path.isfile(gt_path):
+            groundtruths[name] = np.array(load_bboxes(gt_path), dtype=np.int64).reshape(-1, 4)
+    return groundtruths
+
+
+def evaluate_tracker(tracker, root='.', sequences=('Man', 'BlurBody', 'TeaCan')):
+    """ Run a tracker on several sequences and score it against their ground truth.
+
+    Args:
+        tracker (callable)          : tracker(frames, bbox) returning one box (x, y, w, h) per
+                                      frame, given RGB frames and the first ground truth box,
+                                      e.g. track_back_projection.
+        root (str)                  : Directory holding the sequence directories.
+        sequences (tuple)           : Names of the sequences; those without ground truth are
+                                      skipped.
+    Returns:
+        results (dict)              : Sequence name to a dict with per-frame 'iou' and
+                                      'center_error', the success 'auc', 'precision@20' and
+                                      the tracker 'seconds'.
+    """
+    results = {}
+    for name, gt in load_groundtruths(root, sequences).items():
+        frames = load_frames_rgb(os.path.join(root, name, 'img'))
+        n = min(len(frames), len(gt))
+        start = time()
+        pred = np.asarray(tracker(frames[:n], tuple(gt[0])), dtype=np.float64).reshape(-1, 4)
+        seconds = time() - start
+
+        ious = batch_IoU(pred, gt[:n])
+        errors = center_errors(pred, gt[:n])
+        results[name] = {
+            'iou': ious,
+            'center_error': errors,
+            'auc': success_curve(ious)[1],
+            'precision@20': float(precision_curve(errors, [20])[0]),
+            'seconds': seconds,
+        }
+    return results
+
+
 # Part 2:
-def lucas_kanade(img1, img2, keypoints, window_size=9):
+
+# Status codes returned alongside flow vectors
+LK_OK = 0               # flow estimated from a window fully inside both images
+LK_OUT_OF_BOUNDS = 1    # the window left img1 or img2; sampled from the padded border
+LK_ILL_CONDITIONED = 2  # the structure tensor is (close to) singular; flow is rank one
+LK_DIVERGED = 3         # the flow is not finite
+
+
+def lucas_kanade(img1, img2, keypoints, window_size=9, rcond=1e-6, return_status=False):
     """ Estimate flow vector at each keypoint using Lucas-Kanade method.
 
     Args:
@@ -100,45 +517,131 @@ def lucas_kanade(img1, img2, keypoints, window_size=9):
         window_size (int)           : Window size to determine the neighborhood of each keypoint.
                                       A window is centered around the current keypoint location.
                                       You may assume that window_size is always an odd number.
+        rcond (float)               : Windows whose structure tensor has a smaller eigenvalue
+                                      below rcond times its larger one are treated as rank one.
+        return_status (bool)        : Also return a status code (LK_*) for every keypoint.
     Returns:
         flow_vectors (np.ndarray)   : Estimated flow vectors for keypoints. flow_vectors[i] is
                                       the flow vector for keypoint[i]. Array of shape (N, 2).
+        status (np.ndarray)         : Status code of every keypoint of shape (N,). Only returned
+                                      if return_status is True.
 
     Hints:
         - You may use np.linalg.inv to compute inverse matrix.
     """
     assert window_size % 2 == 1, "window_size must be an odd number"
-    
-    flow_vectors = []
-    w = window_size // 2
+
+    keypoints = np.asarray(keypoints).reshape(-1, 2)
 
     # Compute partial derivatives
     Iy, Ix = np.gradient(img1)
     It = img2 - img1
 
-    # For each [y, x] in keypoints, estimate flow vector [vy, vx]
-    # using Lucas-Kanade method and append it to flow_vectors.
-    for y, x in keypoints:
-        # Keypoints can be loacated between integer pixels (subpixel locations).
-        # For simplicity, we round the keypoint coordinates to nearest integer.
-        # In order to achieve more accurate results, image brightness at subpixel
-        # locations can be computed using bilinear interpolation.
-        y, x = int(round(y)), int(round(x))
+    # Keypoints can be loacated between integer pixels (subpixel locations).
+    # For simplicity, we round the keypoint coordinates to nearest integer.
+    # In order to achieve more accurate results, image brightness at subpixel
+    # locations can be computed using bilinear interpolation.
+    ys, xs = _round_keypoints(keypoints, img1.shape)
 
-        """ YOUR CODE STARTS HERE """
-        A = np.zeros((window_size**2, 2))
-        A[:,0] = Ix[y-w:y+w+1, x-w:x+w+1].flatten()
-        A[:,1] = Iy[y-w:y+w+1, x-w:x+w+1].flatten()
-        b = -It[y-w:y+w+1, x-w:x+w+1].flatten()
+    """ YOUR CODE STARTS HERE """
+    # Structure tensor and mismatch vector summed over every window at once
+    sxx, sxy, syy, sxt, syt = _window_sums((Ix * Ix, Ix * Iy, Iy * Iy, Ix * It, Iy * It),
+                                           ys, xs, window_size)
+    vx, vy, well = _solve_2x2(sxx, sxy, syy, -sxt, -syt, rcond)
+    flow_vectors = np.stack([vy, vx], axis=1)
 
-        (vx, vy), _, _, _ = np.linalg.lstsq(A, b)
-        flow_vectors.append((vy, vx))
+    """ YOUR CODE ENDS HERE """
 
-        """ YOUR CODE ENDS HERE """
+    if return_status:
+        inside = _window_inside(keypoints[:, 0], keypoints[:, 1], window_size, img1.shape)
+        status = _flow_status(flow_vectors, inside, well)
+        return flow_vectors, status
+    return flow_vectors
 
-    flow_vectors = np.array(flow_vectors)
 
-    return flow_vectors
+def _round_keypoints(keypoints, shape):
+    """ Round (y, x) keypoints to the nearest pixel inside an image of the given shape. """
+    ys = np.clip(np.rint(keypoints[:, 0]), 0, shape[0] - 1).astype(np.intp)
+    xs = np.clip(np.rint(keypoints[:, 1]), 0, shape[1] - 1).astype(np.intp)
+    return ys, xs
+
+
+def _window_inside(ys, xs, window_size, shape):
+    """ Whether the windows centred on (ys, xs) lie fully inside an image of the given shape. """
+    w = window_size // 2
+    ys = np.asarray(ys, dtype=np.float64)
+    xs = np.asarray(xs, dtype=np.float64)
+    return ((ys - w >= 0) & (ys + w <= shape[0] - 1) &
+            (xs - w >= 0) & (xs + w <= shape[1] - 1))
+
+
+def _flow_status(flow_vectors, inside, well):
+    """ Combine the per-keypoint checks into LK_* status codes. """
+    status = np.full(len(flow_vectors), LK_OK, dtype=np.int8)
+    status[~well] = LK_ILL_CONDITIONED
+    status[~inside] = LK_OUT_OF_BOUNDS
+    status[~np.all(np.isfinite(flow_vectors), axis=1)] = LK_DIVERGED
+    return status
+
+
+def _window_sums(images, ys, xs, window_size):
+    """ Sum each image over the window_size x window_size windows centred on (ys, xs).
+
+    Pixels of a window that fall outside the image count as zero.
+
+    Args:
+        images (tuple)              : Images of the same shape (H, W).
+        ys (np.ndarray)             : Integer row of every window centre, shape (N,).
+        xs (np.ndarray)             : Integer column of every window centre, shape (N,).
+        window_size (int)           : Odd side length of the windows.
+    Returns:
+        sums (list)                 : Window sums of every image, each of shape (N,).
+    """
+    sums = []
+    for img in images:
+        boxed = cv2.boxFilter(np.asarray(img, dtype=np.float64), -1, (window_size, window_size),
+                              normalize=False, borderType=cv2.BORDER_CONSTANT)
+        sums.append(boxed[ys, xs])
+    return sums
+
+
+def _solve_2x2(a, b, c, rx, ry, rcond=1e-6):
+    """ Solve the symmetric systems [[a, b], [b, c]] (vx, vy) = (rx, ry) in closed form.
+
+    Systems whose smaller eigenvalue is below rcond times the larger one (edges,
+    flat regions) get the minimum-norm solution along the dominant eigenvector,
+    as np.linalg.lstsq would; systems with no gradient at all get zero.
+
+    Args:
+        a, b, c (np.ndarray)        : Entries of the symmetric matrices, each of shape (N,).
+        rx, ry (np.ndarray)         : Right hand sides, each of shape (N,).
+        rcond (float)               : Relative eigenvalue threshold for the conditioning check.
+    Returns:
+        vx, vy (np.ndarray)         : Solutions, each of shape (N,).
+        well (np.ndarray)           : Whether each system passed the conditioning check.
+    """
+    half_trace = (a + c) / 2
+    root = np.sqrt(((a - c) / 2) ** 2 + b ** 2)
+    lam_max = half_trace + root
+    lam_min = half_trace - root
+    det = a * c - b * b
+
+    well = lam_min > rcond * lam_max
+    safe_det = np.where(well, det, 1)
+    vx = np.where(well, (c * rx - b * ry) / safe_det, 0)
+    vy = np.where(well, (a * ry - b * rx) / safe_det, 0)
+
+    # Rank one systems: project onto the dominant eigenvector
+    rank1 = ~well & (lam_max > 0)
+    ex = np.where(np.abs(a - lam_min) >= np.abs(c - lam_min), a - lam_min, b)
+    ey = np.where(np.abs(a - lam_min) >= np.abs(c - lam_min), b, c - lam_min)
+    norm = np.hypot(ex, ey)
+    norm = np.where(norm > 0, norm, 1)
+    ex, ey = ex / norm, ey / norm
+    proj = (ex * rx + ey * ry) / np.where(rank1, lam_max, 1)
+    vx = np.where(rank1, proj * ex, vx)
+    vy = np.where(rank1, proj * ey, vy)
+    return vx, vy, well
 
 
 def compute_error(patch1, patch2):
@@ -146,31 +649,64 @@ def compute_error(patch1, patch2):
         - Normalize patch1 and patch2
         - Compute mean square error between patch1 and patch2
 
+    Patches of constant intensity normalize to zero instead of dividing by a zero
+    standard deviation.
+
     Args:
-        patch1 (np.ndarray)         : Grayscale image patch1 of shape (patch_size, patch_size)
-        patch2 (np.ndarray)         : Grayscale image patch2 of shape (patch_size, patch_size)
+        patch1 (np.ndarray)         : Grayscale image patch1 of shape (patch_size, patch_size),
+                                      or a stack of patches of shape (N, patch_size, patch_size)
+        patch2 (np.ndarray)         : Grayscale image patch2 of the same shape as patch1
     Returns:
-        error (float)               : Number representing mismatch between patch1 and patch2.
+        error (float)               : Number representing mismatch between patch1 and patch2,
+                                      or an array of shape (N,) for stacks of patches.
     """
     assert patch1.shape == patch2.shape, 'Differnt patch shapes'
     error = 0
 
     """ YOUR CODE STARTS HERE """
-    patch1 = (patch1 - np.mean(patch1)) / np.std(patch1)
-    patch2 = (patch2 - np.mean(patch2)) / np.std(patch2)
-    
-    error = np.mean(np.square(patch1 - patch2))
+    patch1 = _normalize_patches(patch1)
+    patch2 = _normalize_patches(patch2)
+
+    error = np.mean(np.square(patch1 - patch2), axis=(-2, -1))
 
     """ YOUR CODE ENDS HERE """
 
     return error
 
 
+def _normalize_patches(patches):
+    """ Zero-mean, unit-variance patches over the last two axes; constant patches become zero. """
+    patches = np.asarray(patches, dtype=np.float64)
+    centred = patches - patches.mean(axis=(-2, -1), keepdims=True)
+    std = np.sqrt(np.mean(np.square(centred), axis=(-2, -1), keepdims=True))
+    return np.divide(centred, std, out=np.zeros_like(centred), where=std > 0)
+
+
+def _gather_patches(img, ys, xs, patch_size):
+    """ Square integer-aligned patches centred on (ys, xs), clamped to the image border.
+
+    Args:
+        img (np.ndarray)            : Grayscale image of shape (H, W).
+        ys (np.ndarray)             : Integer row of every patch centre, shape (N,).
+        xs (np.ndarray)             : Integer column of every patch centre, shape (N,).
+        patch_size (int)            : Odd side length of the patches.
+    Returns:
+        patches (np.ndarray)        : Patches of shape (N, patch_size, patch_size).
+    """
+    offsets = np.arange(patch_size) - patch_size // 2
+    rows = np.clip(ys[:, None] + offsets, 0, img.shape[0] - 1)
+    cols = np.clip(xs[:, None] + offsets, 0, img.shape[1] - 1)
+    return img[rows[:, :, None], cols[:, None, :]]
+
+
 
 def iterative_lucas_kanade(img1, img2, keypoints,
                            window_size=9,
                            num_iters=5,
-                           g=None):
+                           g=None,
+                           epsilon=0.01,
+                           gradients=None,
+                           return_status=False):
     """ Estimate flow vector at each keypoint using iterative Lucas-Kanade method.
 
     Args:
@@ -185,9 +721,16 @@ def iterative_lucas_kanade(img1, img2, keypoints,
         num_iters (int)             : Number of iterations to update flow vector.
         g (np.ndarray)              : Flow vector guessed from previous pyramid level.
                                       Array of shape (N, 2).
+        epsilon (float)             : A keypoint stops iterating once its flow update is
+                                      shorter than epsilon pixels.
+        gradients (tuple)           : Precomputed spatial gradients (Iy, Ix) of img1, e.g. from a
+                                      PyramidCache. Computed with np.gradient if not given.
+        return_status (bool)        : Also return a status code (LK_*) for every keypoint.
     Returns:
         flow_vectors (np.ndarray)   : Estimated flow vectors for keypoints. flow_vectors[i] is
                                       the flow vector for keypoint[i]. Array of shape (N, 2).
+        status (np.ndarray)         : Status code of every keypoint of shape (N,). Only returned
+                                      if return_status is True.
     """
     assert window_size % 2 == 1, "window_size must be an odd number"
 
@@ -195,55 +738,88 @@ def iterative_lucas_kanade(img1, img2, keypoints,
     if g is None:
         g = np.zeros(keypoints.shape)
 
-    flow_vectors = []
-    w = window_size // 2
-    
-   
+    keypoints = np.asarray(keypoints, dtype=np.float64).reshape(-1, 2)
+    g = np.asarray(g, dtype=np.float64).reshape(-1, 2)
+    v = np.zeros(keypoints.shape) # Initialize flow vectors as zero vectors (vy, vx)
+
     # Compute spatial gradients
-    Iy, Ix = np.gradient(img1)
+    Iy, Ix = np.gradient(img1) if gradients is None else gradients
 
-    for y, x, gy, gx in np.hstack((keypoints, g)):
-        v = np.zeros(2) # Initialize flow vector as zero vector
-        y1 = int(round(y)); x1 = int(round(x))
-        
-        """ YOUR CODE STARTS HERE """
-        gx, gy = int(round(gx)), int(round(gy))
-        
-        # Compute spatial gradient matrix
-        ix = Ix[y1-w:y1+w+1, x1-w:x1+w+1]
-        iy = Iy[y1-w:y1+w+1, x1-w:x1+w+1]
-        ix_sqr = np.sum(ix * ix)
-        iy_sqr = np.sum(iy * iy)
-        ixiy = np.sum(ix * iy)
-        G = np.array([[ix_sqr, ixiy],
-                      [ixiy, iy_sqr]])
-        G_inverse = np.linalg.inv(G)
-
-        for _ in range(num_iters):
-            vx, vy = v
-            vx, vy = int(round(vx)), int(round(vy))
-
-            temporal_diff = img1[y1-w:y1+w+1, x1-w:x1+w+1] - \
-                img2[y1+gy+vy-w:y1+gy+vy+w+1, x1+gx+vx-w:x1+gx+vx+w+1]
-
-            bk = np.array([[np.sum(temporal_diff * ix)],
-                           [np.sum(temporal_diff * iy)]])
-
-            vk = np.dot(G_inverse, bk)
-            vk = np.reshape(vk, 2)
-
-            v += vk
-        """ YOUR CODE ENDS HERE """
-
-        vx, vy = v
-        flow_vectors.append([vy, vx])
-        
-    return np.array(flow_vectors)
+    """ YOUR CODE STARTS HERE """
+    # Template windows sampled at the true (subpixel) keypoint locations
+    ys, xs = keypoints[:, 0], keypoints[:, 1]
+    patch1 = bilinear_patches(img1, ys, xs, window_size)
+    ix = bilinear_patches(Ix, ys, xs, window_size)
+    iy = bilinear_patches(Iy, ys, xs, window_size)
+
+    # Spatial gradient matrix of every window
+    ix_sqr = np.sum(ix * ix, axis=(1, 2))
+    iy_sqr = np.sum(iy * iy, axis=(1, 2))
+    ixiy = np.sum(ix * iy, axis=(1, 2))
+
+    inside = _window_inside(ys, xs, window_size, img1.shape)
+    well = np.ones(len(keypoints), dtype=bool)
+
+    active = np.arange(len(keypoints))
+    for _ in range(num_iters):
+        if len(active) == 0:
+            break
+        target = keypoints[active] + g[active] + v[active]
+        inside[active] &= _window_inside(target[:, 0], target[:, 1], window_size, img2.shape)
+        temporal_diff = patch1[active] - bilinear_patches(img2, target[:, 0], target[:, 1],
+                                                          window_size)
+        bx = np.sum(temporal_diff * ix[active], axis=(1, 2))
+        by = np.sum(temporal_diff * iy[active], axis=(1, 2))
+
+        vkx, vky, well[active] = _solve_2x2(ix_sqr[active], ixiy[active], iy_sqr[active], bx, by)
+        v[active, 0] += vky
+        v[active, 1] += vkx
+
+        # Keypoints whose update became negligible have converged
+        active = active[np.hypot(vkx, vky) >= epsilon]
+    """ YOUR CODE ENDS HERE """
+
+    if return_status:
+        return v, _flow_status(v, inside, well)
+    return v
+
+
+def bilinear_patches(img, ys, xs, window_size):
+    """ Sample square windows centred on subpixel locations using bilinear interpolation.
+
+    Locations outside the image take the value of the nearest border pixel, so windows
+    crossing the border keep their full size; use _window_inside to tell them apart.
+
+    Args:
+        img (np.ndarray)            : Grayscale image of shape (H, W).
+        ys (np.ndarray)             : Row of every window centre, shape (N,).
+        xs (np.ndarray)             : Column of every window centre, shape (N,).
+        window_size (int)           : Odd side length of the windows.
+    Returns:
+        patches (np.ndarray)        : Sampled windows of shape (N, window_size, window_size).
+    """
+    h, w = img.shape[:2]
+    offsets = np.arange(window_size) - window_size // 2
+    py = np.asarray(ys, dtype=np.float64)[:, None, None] + offsets[None, :, None]
+    px = np.asarray(xs, dtype=np.float64)[:, None, None] + offsets[None, None, :]
+    py = np.clip(py, 0, h - 1)
+    px = np.clip(px, 0, w - 1)
+
+    y0 = np.clip(np.floor(py).astype(np.intp), 0, max(h - 2, 0))
+    x0 = np.clip(np.floor(px).astype(np.intp), 0, max(w - 2, 0))
+    fy = py - y0
+    fx = px - x0
+    y1 = np.minimum(y0 + 1, h - 1)
+    x1 = np.minimum(x0 + 1, w - 1)
+
+    top = img[y0, x0] * (1 - fx) + img[y0, x1] * fx
+    bottom = img[y1, x0] * (1 - fx) + img[y1, x1] * fx
+    return top * (1 - fy) + bottom * fy
         
 
 def pyramid_lucas_kanade(img1, img2, keypoints,
                          window_size=9, num_iters=5,
-                         level=2, scale=2):
+                         level=2, scale=2, cache=None, return_status=False):
 
     """ Pyramidal Lucas Kanade method
 
@@ -260,14 +836,22 @@ def pyramid_lucas_kanade(img1, img2, keypoints,
         level (int)                 : Max level in image pyramid. Original image is at level 0 of
                                       the pyramid.
         scale (float)               : Scaling factor of image pyramid.
+        cache (PyramidCache)        : Cache to take the pyramids and gradients of img1 and img2
+                                      from, so that consecutive calls sharing a frame build its
+                                      pyramid only once.
+        return_status (bool)        : Also return a status code (LK_*) for every keypoint, taken
+                                      from the finest level.
 
     Returns:
         d - final flow vectors
+        status - status code of every keypoint, only returned if return_status is True
     """
 
     # Build image pyramids of img1 and img2
-    pyramid1 = tuple(pyramid_gaussian(img1, max_layer=level, downscale=scale))
-    pyramid2 = tuple(pyramid_gaussian(img2, max_layer=level, downscale=scale))
+    if cache is None:
+        cache = PyramidCache(level, scale)
+    pyramid1 = cache.get(img1, level, scale)
+    pyramid2 = cache.get(img2, level, scale)
 
     # Initialize pyramidal guess
     g = np.zeros(keypoints.shape)
@@ -277,15 +861,70 @@ def pyramid_lucas_kanade(img1, img2, keypoints,
     g = np.zeros(keypoints.shape, dtype=int)
     ss = [scale**l for l in range(level + 1)]
 
-    for i, j, sl in zip(pyramid1[::-1], pyramid2[::-1], ss[::-1]):
+    for (i, Iy, Ix), (j, _, _), sl in zip(pyramid1[::-1], pyramid2[::-1], ss[::-1]):
         g = scale * (g + d)
-        d = iterative_lucas_kanade(i, j, keypoints / sl, g=g)
+        # Windows of coarse levels often cross the border; the finest level sets the status
+        d, status = iterative_lucas_kanade(i, j, keypoints / sl, window_size=window_size,
+                                           num_iters=num_iters, g=g, gradients=(Iy, Ix),
+                                           return_status=True)
     """ YOUR CODE ENDS HERE """
 
     d = g + d
+    if return_status:
+        return d, status
     return d
 
 
+class PyramidCache(object):
+    """ Gaussian pyramids and their spatial gradients for the most recently used frames.
+
+    When tracking over a video, frame i+1 is the second image of one pair and the first
+    image of the next, so keeping the last two frames lets every pyramid be built once.
+
+    Args:
+        level (int)                 : Default max level of the pyramids.
+        scale (float)               : Default scaling factor of the pyramids.
+        size (int)                  : Number of frames to keep.
+    """
+
+    def __init__(self, level=2, scale=2, size=2):
+        self.level = level
+        self.scale = scale
+        self.size = size
+        self._entries = OrderedDict()
+
+    def get(self, img, level=None, scale=None):
+        """ Pyramid of a frame, built on first use.
+
+        Frames are identified by the array object itself, so the frame must not be
+        modified in place while it is cached.
+
+        Args:
+            img (np.ndarray)        : Grayscale frame.
+            level (int)             : Max level of the pyramid; defaults to the cache level.
+            scale (float)           : Scaling factor of the pyramid; defaults to the cache scale.
+        Returns:
+            pyramid (list)          : (image, Iy, Ix) of every level, finest first.
+        """
+        level = self.level if level is None else level
+        scale = self.scale if scale is None else scale
+        key = (id(img), level, scale)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] is img:
+            self._entries.move_to_end(key)
+            return entry[1]
+
+        pyramid = []
+        for layer in pyramid_gaussian(img, max_layer=level, downscale=scale):
+            Iy, Ix = np.gradient(layer)
+            pyramid.append((layer, Iy, Ix))
+        # Keep a reference to the frame so that its id cannot be reused while cached
+        self._entries[key] = (img, pyramid)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+        return pyramid
+
+
 
 
 
@@ -335,9 +974,11 @@ def load_bboxes(gt_path):
     bboxes = []
     with open(gt_path) as f:
         for line in f:
-          
-            x, y, w, h = line.split(',')
-            #x, y, w, h = line.split()
+            # Sequences separate the values with commas or with whitespace
+            values = line.replace(',', ' ').split()
+            if not values:
+                continue
+            x, y, w, h = values
             bboxes.append((int(x), int(y), int(w), int(h)))
     return bboxes
 
@@ -373,7 +1014,10 @@ def animated_bbox(frames, bboxes, figsize=(10,8)):
 
     return ani
 
-def animated_scatter(frames, trajs, figsize=(10,8)):
+def animated_scatter(frames, trajs, figsize=(10,8), mask=None):
+    # Trajectories from track_features come as a (frames, N, 2) array with a (frames, N) mask
+    if mask is not None:
+        trajs = [traj[m] for traj, m in zip(trajs, mask)]
     fig, ax = plt.subplots(figsize=figsize)
     ax.axis('off')
     im = ax.imshow(frames[0])
@@ -411,45 +1055,55 @@ def track_features(frames, keypoints,
         kwargs - keyword arguments for optflow_fn.
 
     Returns:
-        trajs - A list containing tracked keypoints in each frame. trajs[i]
-            is a numpy array of keypoints in frames[i]. The shape of trajs[i]
-            is (Ni, 2), where Ni is number of tracked points in frames[i].
+        trajs - Tracked keypoints of shape (len(frames), N, 2); trajs[i, k] is the position of
+            keypoints[k] in frames[i], NaN once the track is lost.
+        mask - Boolean array of shape (len(frames), N); mask[i, k] tells whether keypoints[k]
+            is still tracked in frames[i]. trajs[i][mask[i]] are the points tracked in frames[i].
     """
 
-    kp_curr = keypoints
-    trajs = [kp_curr]
+    keypoints = np.asarray(keypoints, dtype=np.float64).reshape(-1, 2)
+    trajs = np.full((len(frames),) + keypoints.shape, np.nan)
+    mask = np.zeros((len(frames), len(keypoints)), dtype=bool)
+    trajs[0] = keypoints
+    mask[0] = True
+    alive = np.arange(len(keypoints)) # Track IDs still being followed
     patch_size = 3 # Take 3x3 patches to compute error
-    w = patch_size // 2 # patch_size//2 around a pixel
+
+    # Consecutive pairs share a frame; build each frame's pyramid only once
+    if optflow_fn is pyramid_lucas_kanade and kwargs.get('cache') is None:
+        kwargs['cache'] = PyramidCache(kwargs.get('level', 2), kwargs.get('scale', 2))
 
     for i in range(len(frames) - 1):
         I = frames[i]
         J = frames[i+1]
-        flow_vectors = optflow_fn(I, J, kp_curr, **kwargs)
+        kp_curr = trajs[i, alive]
+        if optflow_fn in (lucas_kanade, iterative_lucas_kanade, pyramid_lucas_kanade):
+            # Drop keypoints whose flow could not be estimated reliably
+            flow_vectors, status = optflow_fn(I, J, kp_curr, return_status=True, **kwargs)
+            keep = status == LK_OK
+        else:
+            flow_vectors = optflow_fn(I, J, kp_curr, **kwargs)
+            keep = np.ones(len(alive), dtype=bool)
         kp_next = kp_curr + flow_vectors
 
-        new_keypoints = []
-        for yi, xi, yj, xj in np.hstack((kp_curr, kp_next)):
-            # Declare a keypoint to be 'lost' IF:
-            # 1. the keypoint falls outside the image J
-            # 2. the error between points in I and J is larger than threshold
-
-            yi = int(round(yi)); xi = int(round(xi))
-            yj = int(round(yj)); xj = int(round(xj))
-            # Point falls outside the image
-            if yj > J.shape[0]-exclude_border-1 or yj < exclude_border or\
-               xj > J.shape[1]-exclude_border-1 or xj < exclude_border:
-                continue
-
-            # Compute error between patches in image I and J
-            patchI = I[yi-w:yi+w+1, xi-w:xi+w+1]
-            patchJ = J[yj-w:yj+w+1, xj-w:xj+w+1]
-            error = compute_error(patchI, patchJ)
-            if error > error_thresh:
-                continue
-
-            new_keypoints.append([yj, xj])
-
-        kp_curr = np.array(new_keypoints)
-        trajs.append(kp_curr)
-
-    return trajs
\ No newline at end of file
+        # Declare a keypoint to be 'lost' IF:
+        # 1. the keypoint falls outside the image J
+        # 2. the error between points in I and J is larger than threshold
+        yi, xi = np.rint(kp_curr).T
+        yj, xj = np.rint(kp_next).T
+        keep &= ((yj >= exclude_border) & (yj <= J.shape[0]-exclude_border-1) &
+                 (xj >= exclude_border) & (xj <= J.shape[1]-exclude_border-1))
+        alive, kp_next = alive[keep], kp_next[keep]
+        yi, xi, yj, xj = (c[keep].astype(np.intp) for c in (yi, xi, yj, xj))
+
+        # Compute error between patches in image I and J
+        patchI = _gather_patches(I, yi, xi, patch_size)
+        patchJ = _gather_patches(J, yj, xj, patch_size)
+        keep = compute_error(patchI, patchJ) <= error_thresh
+        alive = alive[keep]
+
+        # Tracked keypoints are kept at integer pixel positions
+        trajs[i+1, alive] = np.rint(kp_next[keep])
+        mask[i+1, alive] = True
+
+    return trajs, mask